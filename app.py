@@ -5,10 +5,10 @@ Scalp Health AI Analysis System - Malaysia Edition
 # -*- coding: utf-8 -*-
 import sys
 import os
+import io
 
 # 设置UTF-8编码（Windows兼容性）
 if sys.platform.startswith('win'):
-    import io
     # 只在必要时重新包装stdout/stderr，避免关闭已有的包装器
     if not isinstance(sys.stdout, io.TextIOWrapper) or sys.stdout.encoding != 'utf-8':
         try:
@@ -21,25 +21,59 @@ if sys.platform.startswith('win'):
             sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'replace')
 
 import streamlit as st
-import pandas as pd
 from PIL import Image
 
 # 添加utils目录到路径
 sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
 
-from ai_analyzer import analyze_scalp_image, get_care_recommendations
-from recommender import load_products, recommend_products, format_product_card, save_recommendation_history
-from database import init_database, AnalysisHistoryDB, RecommendationDB, setup_database
-from ai_services import AIServiceManager
-from image_annotator import ScalpImageAnnotator
+# 分析、推荐、PDF等较重的模块在使用时再导入，减少冷启动时间
+from database import init_database, ProductDB, AnalysisHistoryDB, RecommendationDB, setup_database, NO_IMAGE_SVG
 from user_auth import UserAuthManager
-from pdf_generator import ScalpAnalysisPDFGenerator
 import uuid
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # 初始化数据库
 setup_database()
 
+# 产品缩略图尺寸（推荐卡片只需小图）
+PRODUCT_THUMB_SIZE = (300, 300)
+
+# 诊断严重程度 -> (提示框函数, 图标, 建议)，未列出的严重程度按轻度处理
+SEVERITY_DISPLAY = {
+    '轻度': (st.info, 'ℹ️', '注意观察'),
+    '早期': (st.info, 'ℹ️', '注意观察'),
+    '中度': (st.warning, '⚡', '建议咨询医生'),
+    '重度': (st.error, '⚠️', '建议尽快就医'),
+    '晚期': (st.error, '⚠️', '建议尽快就医'),
+}
+
+@st.cache_resource
+def load_product_thumbnail(img_path, mtime):
+    """生成产品缩略图的WEBP字节（按文件路径和修改时间缓存，图片损坏或无法读取时返回None）"""
+    buffered = io.BytesIO()
+    try:
+        with Image.open(img_path) as image:
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGB')
+            image.thumbnail(PRODUCT_THUMB_SIZE, Image.Resampling.LANCZOS)
+            image.save(buffered, format="WEBP", quality=80)
+    except OSError:
+        return None
+    return buffered.getvalue()
+
+@st.cache_resource
+def get_local_analysis_executor():
+    """本地图像分析的后台线程池（AI请求等待网络时并行完成本地分析）"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="local-analysis")
+
+@st.cache_resource(max_entries=2)
+def load_product_catalog(catalog_version):
+    """加载产品数据并预计算推荐特征（产品表变化时版本号改变，缓存自动失效）"""
+    from recommender import load_products, build_product_features
+    products_df = load_products()
+    return products_df, build_product_features(products_df)
+
 # 初始化用户认证管理器
 auth_manager = UserAuthManager()
 
@@ -742,15 +776,24 @@ with tab1:
 
             if st.button(button_text, type="primary", disabled=button_disabled):
                 with st.spinner("正在分析您的头皮状况... | Analyzing your scalp condition..."):
+                    from ai_analyzer import analyze_scalp_image, get_care_recommendations
+                    from ai_services import AIServiceManager
+                    from image_annotator import ScalpImageAnnotator
+
                     # Check if AI service is enabled
                     ai_config = st.session_state.get('ai_config', {})
 
                     result = None  # 初始化结果
+                    local_future = None  # 后台本地分析
 
                     # 如果启用了AI服务，优先使用AI分析
                     if ai_config.get('enable_ai', False):
                         service_type = ai_config.get('service', 'Claude (Anthropic)')
 
+                        # 本地分析是CPU计算，AI请求主要在等待网络，两者同时进行；
+                        # 合并结果/回退时直接取用，后面的标注也会命中分析缓存
+                        local_future = get_local_analysis_executor().submit(analyze_scalp_image, image)
+
                         # 显示分析进度
                         progress_text = st.empty()
 
@@ -834,7 +877,7 @@ with tab1:
                                     else:
                                         # 合并本地和AI结果
                                         progress_text.text("🔄 正在执行本地分析...")
-                                        local_result = analyze_scalp_image(image)
+                                        local_result = local_future.result()
                                         result = AIServiceManager.combine_analyses(ai_result, local_result)
                                         result['ai_service_used'] = service_type
 
@@ -846,7 +889,7 @@ with tab1:
                                         progress_text.text("✅ 综合分析完成！")
                                 else:
                                     progress_text.text("⚠️ AI服务不可用，使用本地分析...")
-                                    result = analyze_scalp_image(image)
+                                    result = local_future.result()
                                     result['analysis_method'] = 'Local Analysis (Fallback)'
 
                         except Exception as e:
@@ -936,6 +979,10 @@ with tab1:
                     total_flakes = 0
                     total_follicles = 0
 
+                    # 等后台本地分析结束，第一张图的标注直接命中分析缓存而不是重复计算
+                    if local_future is not None:
+                        wait([local_future])
+
                     if 'uploaded_images' in st.session_state:
                         annotator = ScalpImageAnnotator()
                         for idx, img in enumerate(st.session_state['uploaded_images']):
@@ -1012,6 +1059,7 @@ with tab1:
             with col_pdf2:
                 try:
                     import tempfile
+                    from pdf_generator import ScalpAnalysisPDFGenerator
 
                     # 生成PDF报告
                     pdf_gen = ScalpAnalysisPDFGenerator()
@@ -1405,15 +1453,6 @@ with tab1:
                             st.markdown("---")
 
                 for condition in result['diagnosed_conditions']:
-                    # 严重程度颜色
-                    severity_color = {
-                        '轻度': 'info',
-                        '早期': 'info',
-                        '中度': 'warning',
-                        '重度': 'error',
-                        '晚期': 'error'
-                    }.get(condition['severity'], 'info')
-
                     # 显示诊断卡片
                     confidence = condition.get('confidence', 0)
 
@@ -1465,12 +1504,9 @@ with tab1:
 
                         # 严重程度指示器
                         st.markdown("---")
-                        if condition['severity'] in ['重度', '晚期']:
-                            st.error(f"⚠️ 严重程度：**{condition['severity']}** - 建议尽快就医")
-                        elif condition['severity'] == '中度':
-                            st.warning(f"⚡ 严重程度：**{condition['severity']}** - 建议咨询医生")
-                        else:
-                            st.info(f"ℹ️ 严重程度：**{condition['severity']}** - 注意观察")
+                        show_severity, severity_icon, severity_advice = SEVERITY_DISPLAY.get(
+                            condition['severity'], SEVERITY_DISPLAY['轻度'])
+                        show_severity(f"{severity_icon} 严重程度：**{condition['severity']}** - {severity_advice}")
 
                 # 医学建议
                 if 'medical_advice' in result:
@@ -1496,9 +1532,11 @@ with tab1:
         st.markdown("### 🛒 Recommended Products | 推荐产品")
         
         result = st.session_state['result']
-        
-        # 加载产品数据
-        products_df = load_products('data/products.csv')
+
+        from recommender import recommend_products, save_recommendation_history
+
+        # 加载产品数据（附带预计算的推荐特征）
+        products_df, product_features = load_product_catalog(ProductDB.get_catalog_version())
         
         if not products_df.empty:
             # 获取推荐产品
@@ -1506,7 +1544,8 @@ with tab1:
                 result.get('scalp_type', 'normal'),
                 result.get('concerns', []),
                 products_df,
-                top_n=3
+                top_n=3,
+                features=product_features
             )
 
             # 保存推荐历史（如果有analysis_id）
@@ -1518,19 +1557,17 @@ with tab1:
             
             if not recommended.empty:
                 cols = st.columns(3)
-                for idx, (_, product) in enumerate(recommended.iterrows()):
+                for idx, product in enumerate(recommended.to_dict('records')):
                     with cols[idx]:
                         # 产品容器
                         with st.container():
-                            # 显示产品图片（如果有）
-                            if pd.notna(product.get('image')) and product['image']:
+                            # 显示产品图片（如果有，空值可能是None或NaN；缺失或无法读取时显示占位图）
+                            thumbnail = None
+                            if isinstance(product.get('image'), str) and product['image']:
                                 img_path = f"assets/products/{product['image']}"
                                 if os.path.exists(img_path):
-                                    st.image(img_path, use_container_width=True)
-                                else:
-                                    st.image("https://via.placeholder.com/300x200?text=Product+Image", use_container_width=True)
-                            else:
-                                st.image("https://via.placeholder.com/300x200?text=Product+Image", use_container_width=True)
+                                    thumbnail = load_product_thumbnail(img_path, os.path.getmtime(img_path))
+                            st.image(thumbnail or NO_IMAGE_SVG, use_container_width=True)
 
                             # 产品信息卡片
                             st.markdown(f"### 🏷️ {product['name']}")
@@ -1625,39 +1662,38 @@ with tab2:
         # 显示分析历史
         st.markdown("#### 📋 分析历史")
         history = AnalysisHistoryDB.get_user_history_by_id(user_id, limit=50)
+        has_history = bool(history)
     else:
         # 用户未登录 - 显示当前会话的历史
         st.markdown("### 📊 分析历史 | Analysis History")
         st.info("💡 登录后可查看完整的个人分析历史和统计数据")
 
-        # 获取当前会话的分析历史
-        history = AnalysisHistoryDB.get_user_history(st.session_state['session_id'], limit=20)
+        # 获取当前会话的汇总统计
+        session_summary = AnalysisHistoryDB.get_user_summary(st.session_state['session_id'])
+        has_history = session_summary['total_analyses'] > 0
+        history = []
 
-        if history:
+        if has_history:
             # 显示简单统计信息
             col1, col2, col3 = st.columns(3)
 
-            # 计算平均健康分数
-            avg_score = sum(h['health_score'] for h in history) / len(history)
             with col1:
-                st.metric("平均健康分数", f"{avg_score:.1f}/100")
-
-            # 最常见的头皮类型
-            scalp_types = {}
-            for h in history:
-                scalp_type = h['scalp_type']
-                scalp_types[scalp_type] = scalp_types.get(scalp_type, 0) + 1
-            most_common = max(scalp_types.items(), key=lambda x: x[1])[0] if scalp_types else "无"
+                st.metric("平均健康分数", f"{session_summary['avg_health_score']:.1f}/100")
+
             with col2:
-                st.metric("最常见类型", most_common)
+                st.metric("最常见类型", session_summary['most_common_type'])
 
             with col3:
-                st.metric("本次会话分析", len(history))
+                st.metric("本次会话分析", session_summary['total_analyses'])
 
             st.markdown("---")
 
+            # 详细记录按需加载
+            if st.checkbox("📋 显示详细记录 | Show details", value=False):
+                history = AnalysisHistoryDB.get_user_history(st.session_state['session_id'], limit=20)
+
     # 显示历史记录列表（对所有用户）
-    if history:
+    if has_history:
         for i, record in enumerate(history, 1):
             with st.expander(f"📅 {record['created_at']} - {record['scalp_type']}", expanded=(i==1)):
                 col_a, col_b = st.columns(2)
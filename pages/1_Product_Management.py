@@ -4,18 +4,28 @@ Updated to use SQLite database instead of CSV
 """
 import streamlit as st
 import pandas as pd
+import numpy as np
 from PIL import Image
 import os
+import io
 import sys
+import html
+import math
+import base64
 import shutil
 
 # 添加utils目录到路径
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'utils'))
 
-from database import ProductDB, init_database, get_db_connection
+from database import ProductDB, init_database, get_db_connection, remove_files_async, NO_IMAGE_SVG
+
+@st.cache_resource
+def ensure_database():
+    """初始化数据库（每个进程只执行一次，不在每次重新运行时重复建表）"""
+    init_database()
 
 # 初始化数据库（如果需要）
-init_database()
+ensure_database()
 
 # 页面配置
 st.set_page_config(
@@ -24,8 +34,8 @@ st.set_page_config(
     layout="wide"
 )
 
-# 自定义CSS
-st.markdown("""
+# 自定义CSS和标题（合并为一个元素发送）
+PAGE_HEADER_HTML = """
 <style>
     .admin-header {
         text-align: center;
@@ -51,51 +61,133 @@ st.markdown("""
         margin: 1rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
-
-# 标题
-st.markdown("""
 <div class="admin-header">
     <h1>🛠️ 产品管理后台</h1>
     <h3>Product Management Admin Panel</h3>
     <p>基于SQLite数据库的产品管理系统</p>
 </div>
-""", unsafe_allow_html=True)
+"""
+st.markdown(PAGE_HEADER_HTML, unsafe_allow_html=True)
 
 # 图片目录
 IMAGE_DIR = 'assets/products'
 os.makedirs(IMAGE_DIR, exist_ok=True)
 
+# 允许的图片扩展名（统一小写保存）
+ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+
+# 上传时生成的缩略图（与原图同目录，文件名加后缀）
+THUMB_SUFFIX = ".thumb.webp"
+THUMB_SIZE = (300, 300)
+
+# 产品类型与适用头皮选项
+PRODUCT_TYPES = ("洗发水", "护发素", "护发精华", "头皮护理", "生发水")
+SUITABLE_FOR_OPTIONS = ("油性头皮", "干性头皮", "正常头皮", "敏感头皮", "所有类型", "染发发质", "细软发质")
+# 选项 -> 下标（编辑表单设置默认选中项）
+PRODUCT_TYPE_INDEX = {value: i for i, value in enumerate(PRODUCT_TYPES)}
+SUITABLE_FOR_INDEX = {value: i for i, value in enumerate(SUITABLE_FOR_OPTIONS)}
+
+@st.cache_data(ttl=10, show_spinner=False)
+def list_product_images(dir_mtime):
+    """按目录修改时间缓存图片文件名集合（一次scandir代替逐个exists检查）"""
+    with os.scandir(IMAGE_DIR) as entries:
+        return {entry.name for entry in entries if entry.is_file()}
+
+# 本次运行中已存在的图片文件名
+existing_images = list_product_images(os.path.getmtime(IMAGE_DIR))
+
+def display_image_path(filename):
+    """返回用于显示的图片路径（有缩略图时优先使用缩略图）"""
+    if filename + THUMB_SUFFIX in existing_images:
+        filename += THUMB_SUFFIX
+    return os.path.join(IMAGE_DIR, filename)
+
 def save_uploaded_image(uploaded_file, product_id):
     """保存上传的图片"""
     if uploaded_file is not None:
-        # 获取文件扩展名
-        ext = uploaded_file.name.split('.')[-1]
+        # 获取文件扩展名（小写，非法扩展名不保存）
+        ext = os.path.splitext(uploaded_file.name)[1].lower().lstrip('.')
+        if ext not in ALLOWED_IMAGE_EXTENSIONS:
+            return None
         filename = f"product_{product_id}.{ext}"
         filepath = os.path.join(IMAGE_DIR, filename)
 
-        # 保存文件
+        # 分块流式写入，避免整个文件一次性复制到内存
+        uploaded_file.seek(0)
         with open(filepath, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+            shutil.copyfileobj(uploaded_file, f, 1 << 20)
+
+        # 生成缩略图，显示时不再每次解码原图
+        try:
+            with Image.open(filepath) as img:
+                img.draft('RGB', THUMB_SIZE)  # JPEG按比例缩小解码
+                img.thumbnail(THUMB_SIZE, Image.Resampling.LANCZOS)
+                img.save(filepath + THUMB_SUFFIX, "WEBP", quality=80)
+        except OSError:
+            pass
 
         return filename
     return None
 
+def upload_preview(uploaded_file, state_key):
+    """生成上传图片的预览缩略图（同一文件只解码一次，结果保存在session_state）"""
+    cached = st.session_state.get(state_key)
+    if cached and cached[0] == uploaded_file.file_id:
+        return cached[1]
+
+    try:
+        with Image.open(uploaded_file) as img:
+            img.draft('RGB', (400, 400))
+            img.thumbnail((400, 400))
+            buf = io.BytesIO()
+            img.save(buf, format='WEBP', quality=80)
+            preview = buf.getvalue()
+    except OSError:
+        preview = uploaded_file.getvalue()
+    uploaded_file.seek(0)
+
+    st.session_state[state_key] = (uploaded_file.file_id, preview)
+    return preview
+
+@st.cache_data(show_spinner=False)
+def load_products(catalog_version):
+    """按目录版本号缓存全部产品（增删改后版本号变化，缓存自动失效）"""
+    return ProductDB.get_all_products(active_only=False)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def search_products(catalog_version, keyword):
+    """按目录版本号缓存搜索结果"""
+    return ProductDB.search_products(keyword)
+
+# 每次运行只读取一次目录版本、加载一次全部产品，各标签页共用
+catalog_version = ProductDB.get_catalog_version()
+all_products_df = load_products(catalog_version)
+active_products_df = all_products_df[all_products_df['is_active'] == 1]
+
+# 编辑/删除下拉框：选项直接是产品ID，标签经format_func查表显示
+product_ids = all_products_df['id'].tolist()
+product_labels = dict(zip(product_ids, ("ID " + all_products_df['id'].astype(str) + ": "
+                                        + all_products_df['name'].astype(str) + " ("
+                                        + all_products_df['brand'].astype(str) + ")")))
+product_positions = {pid: pos for pos, pid in enumerate(product_ids)}
+
+@st.cache_data(show_spinner=False)
+def load_stats(catalog_version):
+    """按目录版本号缓存产品统计"""
+    return ProductDB.get_stats()
+
 # 显示统计信息
-def show_stats():
+def show_stats(stats):
     """显示统计信息"""
     col1, col2, col3, col4 = st.columns(4)
 
-    products_df = ProductDB.get_all_products(active_only=False)
-    active_products = ProductDB.get_all_products(active_only=True)
-
     with col1:
         st.markdown("""
         <div class="stats-card">
             <h2>{}</h2>
             <p>总产品数</p>
         </div>
-        """.format(len(products_df)), unsafe_allow_html=True)
+        """.format(stats['total_products']), unsafe_allow_html=True)
 
     with col2:
         st.markdown("""
@@ -103,102 +195,184 @@ def show_stats():
             <h2>{}</h2>
             <p>活跃产品</p>
         </div>
-        """.format(len(active_products)), unsafe_allow_html=True)
+        """.format(stats['active_products']), unsafe_allow_html=True)
 
     with col3:
-        avg_price = active_products['price_myr'].mean() if not active_products.empty else 0
         st.markdown("""
         <div class="stats-card" style="background: linear-gradient(135deg, #eb3349 0%, #f45c43 100%);">
             <h2>RM {:.2f}</h2>
             <p>平均价格</p>
         </div>
-        """.format(avg_price), unsafe_allow_html=True)
+        """.format(stats['avg_price']), unsafe_allow_html=True)
 
     with col4:
-        # 计算有图片的产品数
-        with_images = len(active_products[active_products['image'].notna() & (active_products['image'] != '')])
         st.markdown("""
         <div class="stats-card" style="background: linear-gradient(135deg, #f2994a 0%, #f2c94c 100%);">
             <h2>{}</h2>
             <p>有图片产品</p>
         </div>
-        """.format(with_images), unsafe_allow_html=True)
+        """.format(stats['with_images']), unsafe_allow_html=True)
+
+def paginate(df, key, page_sizes=(10, 25, 50)):
+    """分页控件，返回当前页的数据切片"""
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("每页", page_sizes, index=0, key=f"{key}_page_size")
+    page_count = max(1, math.ceil(len(df) / page_size))
+    with col2:
+        page = st.number_input("页", min_value=1, max_value=page_count, value=1, key=f"{key}_page")
+    st.caption(f"第 {page} / {page_count} 页")
+
+    return df.iloc[(page - 1) * page_size:page * page_size]
+
+def badge(text, color):
+    """生成带颜色的状态标签HTML（text/color可为字符串或pandas Series）"""
+    return '<span style="color: ' + color + '; font-weight: bold;">' + text + '</span>'
+
+def _esc(series):
+    """整列转字符串并做HTML转义"""
+    return series.astype(str).map(html.escape)
+
+def product_cards_html(df):
+    """按列向量化拼接一批产品的卡片HTML（信息、状态、库存、图片状态），返回与df同索引的Series"""
+    status = pd.Series(np.where(df['is_active'].astype(bool),
+                                badge("✅ 活跃", "#28a745"), badge("❌ 已停用", "#dc3545")), index=df.index)
+
+    stock = df['stock_quantity']
+    stock_color = pd.Series(np.select([stock > 10, stock > 0], ["#28a745", "#f0ad4e"], default="#dc3545"),
+                            index=df.index)
+    stock_badge = badge(("库存: " + stock.astype(str)).where(stock > 0, "缺货"), stock_color)
+
+    has_image = df['image'].notna() & df['image'].astype(bool)
+    image_badge = pd.Series(np.where(has_image, badge("✅ 有图片", "#28a745"), badge("⚠️ 无图片", "#f0ad4e")),
+                            index=df.index)
+
+    return ('<div class="product-card">'
+            + "<b>ID:</b> " + _esc(df['id']) + " | <b>产品:</b> " + _esc(df['name']) + "<br>"
+            + "<b>品牌:</b> " + _esc(df['brand']) + " | <b>类型:</b> " + _esc(df['type']) + "<br>"
+            + "<b>适用:</b> " + _esc(df['suitable_for']) + " | <b>针对:</b> " + _esc(df['concern']) + "<br>"
+            + "<b>价格:</b> RM " + _esc(df['price_myr']) + "<br>"
+            + "<b>描述:</b> " + _esc(df['description']) + "<br>"
+            + status + " &nbsp;|&nbsp; " + stock_badge + " &nbsp;|&nbsp; " + image_badge
+            + '</div>')
+
+def render_product_card(image, card_html):
+    """渲染单个产品的详细卡片（图片 + 预先拼好的HTML信息块）"""
+    col1, col2 = st.columns([1, 5])
+
+    with col1:
+        # 显示产品图片
+        if pd.notna(image) and image in existing_images:
+            st.image(display_image_path(image), width=150)
+        else:
+            st.image(NO_IMAGE_SVG, width=150)
+
+    with col2:
+        st.markdown(card_html, unsafe_allow_html=True)
+
+# 产品列表表格视图的列与显示配置
+PRODUCT_TABLE_COLUMNS = ['id', 'image', 'name', 'brand', 'type', 'suitable_for',
+                         'concern', 'price_myr', 'stock_quantity', 'is_active']
+PRODUCT_TABLE_CONFIG = {
+    'id': st.column_config.NumberColumn("ID", width="small"),
+    'image': st.column_config.ImageColumn("图片", width="small"),
+    'name': "产品",
+    'brand': "品牌",
+    'type': "类型",
+    'suitable_for': "适用",
+    'concern': "针对",
+    'price_myr': st.column_config.NumberColumn("价格", format="RM %.2f"),
+    'stock_quantity': st.column_config.NumberColumn("库存"),
+    'is_active': st.column_config.CheckboxColumn("活跃"),
+}
+
+@st.cache_data(show_spinner=False)
+def image_thumbnail_uri(img_path, mtime):
+    """生成表格用的缩略图data URI（按文件修改时间缓存，图片损坏或无法读取时返回None）"""
+    buf = io.BytesIO()
+    try:
+        with Image.open(img_path) as img:
+            img.draft('RGB', (100, 100))
+            img.thumbnail((100, 100))
+            img.save(buf, format='WEBP', quality=80)
+    except OSError:
+        return None
+    return "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode()
 
 # 显示统计
-show_stats()
+show_stats(load_stats(catalog_version))
 
-# 主界面
+# 主界面（各标签页为fragment：页内交互只重新运行该标签页，数据变更后仍整页刷新）
 tabs = st.tabs(["📋 产品列表", "➕ 添加产品", "✏️ 编辑产品", "🗑️ 删除产品", "🔍 搜索产品"])
 
 # Tab 1: 产品列表
-with tabs[0]:
+@st.fragment
+def render_list_tab():
     st.markdown("### 📋 当前产品列表 | Current Products")
 
     # 选项
-    col1, col2 = st.columns([2, 1])
+    col1, col2, col3 = st.columns([2, 2, 1])
     with col1:
         show_inactive = st.checkbox("显示已停用产品", value=False)
     with col2:
+        view_mode = st.radio("显示方式", ["表格视图", "卡片视图", "网格视图"], horizontal=True, label_visibility="collapsed")
+    with col3:
         if st.button("🔄 刷新数据", use_container_width=True):
             st.rerun()
 
-    products_df = ProductDB.get_all_products(active_only=not show_inactive)
+    products_df = all_products_df if show_inactive else active_products_df
 
     if not products_df.empty:
         st.info(f"共有 {len(products_df)} 个{'活跃' if not show_inactive else ''}产品")
 
-        # 显示产品
-        for idx, product in products_df.iterrows():
-            with st.container():
-                col1, col2, col3, col4 = st.columns([1, 3, 1, 1])
-
-                with col1:
-                    # 显示产品图片
-                    if pd.notna(product.get('image')) and product['image']:
-                        img_path = os.path.join(IMAGE_DIR, product['image'])
-                        if os.path.exists(img_path):
-                            st.image(img_path, width=150)
-                        else:
-                            st.image("https://via.placeholder.com/150x150?text=No+Image", width=150)
-                    else:
-                        st.image("https://via.placeholder.com/150x150?text=No+Image", width=150)
-
-                with col2:
-                    st.markdown(f"**ID:** {product['id']} | **产品:** {product['name']}")
-                    st.markdown(f"**品牌:** {product['brand']} | **类型:** {product['type']}")
-                    st.markdown(f"**适用:** {product['suitable_for']} | **针对:** {product['concern']}")
-                    st.markdown(f"**价格:** RM {product['price_myr']}")
-                    st.markdown(f"**描述:** {product['description']}")
-
-                    # 显示状态
-                    if product.get('is_active', True):
-                        st.success("✅ 活跃")
-                    else:
-                        st.error("❌ 已停用")
-
-                with col3:
-                    # 库存信息
-                    stock = product.get('stock_quantity', 100)
-                    if stock > 10:
-                        st.success(f"库存: {stock}")
-                    elif stock > 0:
-                        st.warning(f"库存: {stock}")
-                    else:
-                        st.error("缺货")
-
-                with col4:
-                    # 图片状态
-                    if pd.notna(product.get('image')) and product['image']:
-                        st.success("✅ 有图片")
-                    else:
-                        st.warning("⚠️ 无图片")
-
-                st.markdown("---")
+        # 表格视图：一次性发送整张表（虚拟滚动），选中行时再展开详细卡片
+        if view_mode == "表格视图":
+            table_df = products_df[PRODUCT_TABLE_COLUMNS].copy()
+            image_paths = (display_image_path(name) if name in existing_images else None for name in table_df['image'])
+            table_df['image'] = [
+                image_thumbnail_uri(path, os.path.getmtime(path)) if path else None
+                for path in image_paths
+            ]
+            table_df['is_active'] = table_df['is_active'].astype(bool)
+            event = st.dataframe(
+                table_df,
+                column_config=PRODUCT_TABLE_CONFIG,
+                hide_index=True,
+                use_container_width=True,
+                on_select="rerun",
+                selection_mode="single-row",
+                key="product_table"
+            )
+
+            selected_rows = event.selection.rows
+            if selected_rows:
+                selected = products_df.iloc[[selected_rows[0]]]
+                with st.expander(f"📦 产品详情 | {selected['name'].iloc[0]}", expanded=True):
+                    render_product_card(selected['image'].iloc[0], product_cards_html(selected).iloc[0])
+        elif view_mode == "网格视图":
+            # 网格视图：当前页的缩略图在一次st.image调用中发送
+            view = paginate(products_df, key="grid")
+            paths = [display_image_path(name) if name in existing_images else NO_IMAGE_SVG
+                     for name in view['image']]
+            captions = [f"{name} (RM {price})" for name, price in zip(view['name'], view['price_myr'])]
+            if paths:
+                st.image(paths, width=150, caption=captions)
+        else:
+            # 卡片视图：分页，只渲染当前页；整页卡片HTML先按列一次拼好，循环只负责输出
+            view = paginate(products_df, key="list")
+            for image, card_html in zip(view['image'], product_cards_html(view)):
+                with st.container():
+                    render_product_card(image, card_html)
+                    st.markdown("---")
     else:
         st.warning("暂无产品数据")
 
+with tabs[0]:
+    render_list_tab()
+
 # Tab 2: 添加产品
-with tabs[1]:
+@st.fragment
+def render_add_tab():
     st.markdown("### ➕ 添加新产品 | Add New Product")
 
     with st.form("add_product_form"):
@@ -208,10 +382,8 @@ with tabs[1]:
             st.markdown("#### 基本信息 | Basic Info")
             new_name = st.text_input("产品名称 | Product Name *", placeholder="例如: Anti-Dandruff Shampoo")
             new_brand = st.text_input("品牌 | Brand *", placeholder="例如: Head & Shoulders")
-            new_type = st.selectbox("产品类型 | Type *",
-                                    ["洗发水", "护发素", "护发精华", "头皮护理", "生发水"])
-            new_suitable = st.selectbox("适用头皮 | Suitable For *",
-                                       ["油性头皮", "干性头皮", "正常头皮", "敏感头皮", "所有类型", "染发发质", "细软发质"])
+            new_type = st.selectbox("产品类型 | Type *", PRODUCT_TYPES)
+            new_suitable = st.selectbox("适用头皮 | Suitable For *", SUITABLE_FOR_OPTIONS)
             new_concern = st.text_input("针对问题 | Concern *",
                                        placeholder="例如: 头屑/油腻")
 
@@ -230,7 +402,7 @@ with tabs[1]:
                                         help="支持JPG、PNG格式")
 
             if new_image:
-                st.image(new_image, caption="预览", width=200)
+                st.image(upload_preview(new_image, "add_image_preview"), caption="预览", width=200)
 
         submitted = st.form_submit_button("✅ 添加产品 | Add Product", type="primary", use_container_width=True)
 
@@ -250,14 +422,9 @@ with tabs[1]:
                     'stock_quantity': new_stock
                 }
 
-                # 添加到数据库
-                new_id = ProductDB.add_product(product_data)
-
-                # 保存图片
-                if new_image and new_id:
-                    image_filename = save_uploaded_image(new_image, new_id)
-                    # 更新图片路径
-                    ProductDB.update_product(new_id, {'image': image_filename})
+                # 添加到数据库（图片在同一事务内保存并写入文件名）
+                image_saver = (lambda product_id: save_uploaded_image(new_image, product_id)) if new_image else None
+                new_id = ProductDB.add_product(product_data, image_saver=image_saver)
 
                 st.success(f"✅ 产品添加成功！ID: {new_id}")
                 st.balloons()
@@ -265,23 +432,23 @@ with tabs[1]:
             else:
                 st.error("⚠️ 请填写所有必填项（标*）")
 
+with tabs[1]:
+    render_add_tab()
+
 # Tab 3: 编辑产品
-with tabs[2]:
+@st.fragment
+def render_edit_tab():
     st.markdown("### ✏️ 编辑产品 | Edit Product")
 
-    products_df = ProductDB.get_all_products(active_only=False)
+    products_df = all_products_df
 
     if not products_df.empty:
         # 选择要编辑的产品
-        product_options = products_df.apply(
-            lambda x: f"ID {x['id']}: {x['name']} ({x['brand']})", axis=1
-        ).tolist()
+        selected_id = st.selectbox("选择要编辑的产品 | Select Product", product_ids,
+                                   format_func=product_labels.get, key="edit_select")
 
-        selected_product = st.selectbox("选择要编辑的产品 | Select Product", product_options)
-        selected_id = int(selected_product.split(":")[0].replace("ID ", ""))
-
-        # 获取产品数据
-        product = ProductDB.get_product_by_id(selected_id)
+        # 直接按ID定位共享数据中的这一行（无需再查询数据库）
+        product = products_df.iloc[[product_positions[selected_id]]].to_dict('records')[0]
 
         if product:
             with st.form("edit_product_form"):
@@ -291,12 +458,10 @@ with tabs[2]:
                     st.markdown("#### 基本信息 | Basic Info")
                     edit_name = st.text_input("产品名称", value=product['name'])
                     edit_brand = st.text_input("品牌", value=product['brand'])
-                    edit_type = st.selectbox("产品类型",
-                                            ["洗发水", "护发素", "护发精华", "头皮护理", "生发水"],
-                                            index=["洗发水", "护发素", "护发精华", "头皮护理", "生发水"].index(product['type']) if product['type'] in ["洗发水", "护发素", "护发精华", "头皮护理", "生发水"] else 0)
-                    edit_suitable = st.selectbox("适用头皮",
-                                               ["油性头皮", "干性头皮", "正常头皮", "敏感头皮", "所有类型", "染发发质", "细软发质"],
-                                               index=["油性头皮", "干性头皮", "正常头皮", "敏感头皮", "所有类型", "染发发质", "细软发质"].index(product['suitable_for']) if product['suitable_for'] in ["油性头皮", "干性头皮", "正常头皮", "敏感头皮", "所有类型", "染发发质", "细软发质"] else 0)
+                    edit_type = st.selectbox("产品类型", PRODUCT_TYPES,
+                                            index=PRODUCT_TYPE_INDEX.get(product['type'], 0))
+                    edit_suitable = st.selectbox("适用头皮", SUITABLE_FOR_OPTIONS,
+                                               index=SUITABLE_FOR_INDEX.get(product['suitable_for'], 0))
                     edit_concern = st.text_input("针对问题", value=product['concern'])
                     edit_active = st.checkbox("产品活跃", value=product.get('is_active', True))
 
@@ -311,16 +476,15 @@ with tabs[2]:
 
                     # 显示当前图片
                     if pd.notna(product.get('image')) and product['image']:
-                        img_path = os.path.join(IMAGE_DIR, product['image'])
-                        if os.path.exists(img_path):
-                            st.image(img_path, caption="当前图片", width=200)
+                        if product['image'] in existing_images:
+                            st.image(display_image_path(product['image']), caption="当前图片", width=200)
 
                     edit_image = st.file_uploader("上传新图片（留空保持不变）",
                                                 type=['jpg', 'jpeg', 'png'],
                                                 key="edit_image")
 
                     if edit_image:
-                        st.image(edit_image, caption="新图片预览", width=200)
+                        st.image(upload_preview(edit_image, "edit_image_preview"), caption="新图片预览", width=200)
 
                 submitted = st.form_submit_button("💾 保存修改 | Save Changes", type="primary", use_container_width=True)
 
@@ -342,7 +506,8 @@ with tabs[2]:
                     # 处理图片更新
                     if edit_image:
                         image_filename = save_uploaded_image(edit_image, selected_id)
-                        update_data['image'] = image_filename
+                        if image_filename:
+                            update_data['image'] = image_filename
 
                     # 更新数据库
                     if ProductDB.update_product(selected_id, update_data):
@@ -353,11 +518,15 @@ with tabs[2]:
     else:
         st.warning("暂无产品可编辑")
 
+with tabs[2]:
+    render_edit_tab()
+
 # Tab 4: 删除产品
-with tabs[3]:
+@st.fragment
+def render_delete_tab():
     st.markdown("### 🗑️ 删除产品 | Delete Product")
 
-    products_df = ProductDB.get_all_products(active_only=False)
+    products_df = all_products_df
 
     if not products_df.empty:
         st.warning("⚠️ 删除操作不可恢复，请谨慎操作！")
@@ -366,23 +535,18 @@ with tabs[3]:
         delete_mode = st.radio("删除方式", ["软删除（标记为停用）", "硬删除（永久删除）"])
 
         # 选择要删除的产品
-        product_options = products_df.apply(
-            lambda x: f"ID {x['id']}: {x['name']} ({x['brand']})", axis=1
-        ).tolist()
-
-        selected_product = st.selectbox("选择要删除的产品 | Select Product to Delete", product_options, key="delete_select")
-        selected_id = int(selected_product.split(":")[0].replace("ID ", ""))
+        selected_id = st.selectbox("选择要删除的产品 | Select Product to Delete", product_ids,
+                                   format_func=product_labels.get, key="delete_select")
 
         # 获取产品信息
-        product = ProductDB.get_product_by_id(selected_id)
+        product = products_df.iloc[[product_positions[selected_id]]].to_dict('records')[0]
 
         if product:
             col1, col2 = st.columns([1, 2])
             with col1:
                 if pd.notna(product.get('image')) and product['image']:
-                    img_path = os.path.join(IMAGE_DIR, product['image'])
-                    if os.path.exists(img_path):
-                        st.image(img_path, width=200)
+                    if product['image'] in existing_images:
+                        st.image(display_image_path(product['image']), width=200)
 
             with col2:
                 st.markdown(f"**产品名称:** {product['name']}")
@@ -404,17 +568,13 @@ with tabs[3]:
             if st.button("🗑️ 删除产品 | Delete Product", type="primary", disabled=not confirm, use_container_width=True):
                 soft_delete = (delete_mode == "软删除（标记为停用）")
 
-                # 如果是硬删除，删除图片文件
-                if not soft_delete and pd.notna(product.get('image')) and product['image']:
-                    img_path = os.path.join(IMAGE_DIR, product['image'])
-                    if os.path.exists(img_path):
-                        try:
-                            os.remove(img_path)
-                        except Exception as e:
-                            st.warning(f"图片删除失败: {e}")
-
                 # 删除产品
                 if ProductDB.delete_product(selected_id, soft_delete=soft_delete):
+                    # 硬删除：数据库已删除后再在后台删除图片文件及其缩略图
+                    if not soft_delete and pd.notna(product.get('image')) and product['image']:
+                        img_path = os.path.join(IMAGE_DIR, product['image'])
+                        remove_files_async([img_path, img_path + THUMB_SUFFIX])
+
                     if soft_delete:
                         st.success("✅ 产品已停用！")
                     else:
@@ -425,44 +585,54 @@ with tabs[3]:
     else:
         st.warning("暂无产品可删除")
 
+with tabs[3]:
+    render_delete_tab()
+
 # Tab 5: 搜索产品
-with tabs[4]:
+@st.fragment
+def render_search_tab():
     st.markdown("### 🔍 搜索产品 | Search Products")
 
-    search_keyword = st.text_input("输入搜索关键词（产品名、品牌、类型、描述等）", placeholder="例如: 洗发水")
-
-    if st.button("🔍 搜索", type="primary", use_container_width=True) or search_keyword:
-        if search_keyword:
-            results = ProductDB.search_products(search_keyword)
-
-            if not results.empty:
-                st.success(f"找到 {len(results)} 个相关产品")
-
-                for idx, product in results.iterrows():
-                    with st.container():
-                        col1, col2, col3 = st.columns([1, 3, 1])
-
-                        with col1:
-                            if pd.notna(product.get('image')) and product['image']:
-                                img_path = os.path.join(IMAGE_DIR, product['image'])
-                                if os.path.exists(img_path):
-                                    st.image(img_path, width=100)
-
-                        with col2:
-                            st.markdown(f"**{product['name']}** ({product['brand']})")
-                            st.markdown(f"类型: {product['type']} | 价格: RM {product['price_myr']}")
-                            st.markdown(f"描述: {product['description']}")
+    # 放在表单中：输入时不触发重新运行，点击按钮或回车才搜索
+    with st.form("search_form"):
+        search_keyword = st.text_input("输入搜索关键词（产品名、品牌、类型、描述等）", placeholder="例如: 洗发水")
+        if st.form_submit_button("🔍 搜索", type="primary", use_container_width=True):
+            st.session_state.last_search = search_keyword.strip()
+
+    last_search = st.session_state.get("last_search", "")
+    if last_search:
+        results = search_products(catalog_version, last_search)
+
+        if not results.empty:
+            st.success(f"找到 {len(results)} 个相关产品")
+
+            for product in paginate(results, key="search").to_dict('records'):
+                with st.container():
+                    col1, col2, col3 = st.columns([1, 3, 1])
+
+                    with col1:
+                        if pd.notna(product.get('image')) and product['image']:
+                            if product['image'] in existing_images:
+                                st.image(display_image_path(product['image']), width=100)
+
+                    with col2:
+                        st.markdown(f"**{product['name']}** ({product['brand']})")
+                        st.markdown(f"类型: {product['type']} | 价格: RM {product['price_myr']}")
+                        st.markdown(f"描述: {product['description']}")
+
+                    with col3:
+                        st.markdown(f"库存: {product.get('stock_quantity', 0)}")
+                        if product.get('is_active', True):
+                            st.success("✅ 活跃")
+                        else:
+                            st.error("❌ 停用")
 
-                        with col3:
-                            st.markdown(f"库存: {product.get('stock_quantity', 0)}")
-                            if product.get('is_active', True):
-                                st.success("✅ 活跃")
-                            else:
-                                st.error("❌ 停用")
+                    st.markdown("---")
+        else:
+            st.warning(f"未找到包含 '{last_search}' 的产品")
 
-                        st.markdown("---")
-            else:
-                st.warning(f"未找到包含 '{search_keyword}' 的产品")
+with tabs[4]:
+    render_search_tab()
 
 # 页脚
 st.markdown("---")
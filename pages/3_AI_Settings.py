@@ -7,11 +7,12 @@ import streamlit as st
 import os
 import json
 import sys
+import re
 
-# Add utils to path
-sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
-
-from ai_services import AIServiceManager
+# Add utils to path (only once; the page script re-runs on every widget change)
+UTILS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+if UTILS_DIR not in sys.path:
+    sys.path.append(UTILS_DIR)
 
 # Page config
 st.set_page_config(
@@ -20,19 +21,121 @@ st.set_page_config(
     layout="wide"
 )
 
-def save_api_keys(config):
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_cached_services():
+    """Cache service availability (depends only on installed packages, not on reruns)"""
+    # 延迟导入：ai_services会连带加载openai/PIL/requests，只在缓存未命中时导入
+    from ai_services import AIServiceManager
+    return AIServiceManager.get_available_services()
+
+@st.cache_resource(show_spinner=False)
+def get_anthropic_client(api_key):
+    """Reuse one Anthropic client (and its HTTP connection pool) per API key"""
+    from anthropic import Anthropic
+    return Anthropic(api_key=api_key)
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key):
+    """Reuse one OpenAI client (and its HTTP connection pool) per API key"""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+# 连通性测试应快速失败：不重试，单次请求最多等待5秒
+TEST_TIMEOUT = 5.0
+
+@st.cache_data(ttl=300, show_spinner=False)
+def probe_claude(api_key):
+    """Send one Claude test request; a successful response is cached per key for 5 minutes"""
+    # 失败时直接抛出异常，st.cache_data不会缓存异常，下次点击会重新测试
+    client = get_anthropic_client(api_key).with_options(max_retries=0, timeout=TEST_TIMEOUT)
+    message = client.messages.create(
+        model="claude-3-haiku-20240307",  # 使用可用的Haiku模型
+        max_tokens=5,  # 只测连通性，不需要长回复
+        messages=[
+            {"role": "user", "content": "ping"}
+        ]
+    )
+    return message.content[0].text
+
+class NoModelAvailableError(Exception):
+    """None of the preferred OpenAI test models is available to this account"""
+
+@st.cache_data(ttl=300, show_spinner=False)
+def probe_openai(api_key):
+    """Send one OpenAI test request; returns (used_model, response), cached per key for 5 minutes"""
+    client = get_openai_client(api_key).with_options(max_retries=0, timeout=TEST_TIMEOUT)
+
+    # 先用一次models.list()查出账户可用的模型，再按偏好顺序本地挑选
+    models_to_test = ["gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"]
+    available_models = {m.id for m in client.models.list()}
+    used_model = next((m for m in models_to_test if m in available_models), None)
+    if not used_model:
+        # 抛异常而不是返回空值：st.cache_data不缓存异常，账户开通模型后再测试立即生效
+        raise NoModelAvailableError("所有测试的模型都不可用")
+
+    # 只对选中的模型发一次测试请求
+    response = client.chat.completions.create(
+        model=used_model,
+        messages=[
+            {"role": "user", "content": "ping"}
+        ],
+        max_tokens=5
+    )
+    return used_model, response.choices[0].message.content
+
+# API error message classification: one regex pass, buckets checked in priority order
+API_ERROR_RE = re.compile(r'(?P<auth>authentication|api_key)|(?P<rate>rate|quota)|(?P<network>network|connection)', re.I)
+API_ERROR_PRIORITY = ('auth', 'rate', 'network')
+
+def classify_api_error(error_msg):
+    """Return 'auth', 'rate', 'network' or 'other' for an API error message"""
+    found = {match.lastgroup for match in API_ERROR_RE.finditer(error_msg)}
+    return next((kind for kind in API_ERROR_PRIORITY if kind in found), 'other')
+
+# Optional local config file (opt-in via "Remember settings on this machine")
+AI_CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".scalp_ai_config.json")
+# 配置文件属于服务器进程、被所有访客会话共享，只在单用户本地部署显式设置 SCALP_REMEMBER_SETTINGS=1 时启用
+REMEMBER_SETTINGS_ENABLED = os.getenv('SCALP_REMEMBER_SETTINGS', '') == '1'
+
+@st.cache_data(show_spinner=False)
+def read_config_file(mtime_ns):
+    """Read the saved config file (cached per file mtime, so reruns don't re-read it)"""
+    with open(AI_CONFIG_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+def load_saved_config():
+    """Return the saved config dict, or None if persistence is disabled or there is no readable config file"""
+    if not REMEMBER_SETTINGS_ENABLED:
+        return None
+    try:
+        return read_config_file(os.stat(AI_CONFIG_PATH).st_mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+def write_config_file(config):
+    """Atomically write the config file (owner-only permissions)"""
+    tmp_path = AI_CONFIG_PATH + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+    # 先写临时文件再替换，避免中途失败留下半个文件
+    os.replace(tmp_path, AI_CONFIG_PATH)
+
+def save_api_keys(config, persist=False):
     """Save API keys to session state and optionally to file"""
     st.session_state['ai_config'] = config
-    # You can also save to a config file if needed
-    # But for security, it's better to use environment variables
-
-def load_api_keys():
-    """Load API keys from session state or environment"""
-    if 'ai_config' in st.session_state:
-        return st.session_state['ai_config']
-
-    # Try loading from environment variables
-    config = {
+    if not REMEMBER_SETTINGS_ENABLED:
+        return
+    if persist:
+        write_config_file(config)
+    elif os.path.exists(AI_CONFIG_PATH):
+        # 取消勾选"记住设置"时删除本地文件
+        os.remove(AI_CONFIG_PATH)
+
+@st.cache_data(show_spinner=False)
+def default_ai_config():
+    """Default config from environment variables (looked up once per process; callers get a copy)"""
+    return {
         'service': 'Local Analysis (Rule-based)',
         'claude_api_key': os.getenv('ANTHROPIC_API_KEY', ''),
         'openai_api_key': os.getenv('OPENAI_API_KEY', ''),
@@ -40,49 +143,107 @@ def load_api_keys():
         'combine_results': True,
         'language': 'zh'
     }
-    return config
+
+# Usage guide text (static; kept at module level and pre-dedented)
+USAGE_GUIDE_MD = """\
+### 🚀 Quick Start Guide
+
+1. **Choose an AI Service:**
+   - **Claude (Anthropic)**: Best for detailed medical analysis with high accuracy
+   - **GPT-4 Vision (OpenAI)**: Good for general scalp analysis with fast response
+   - **Local Analysis**: Free rule-based analysis without API requirements
+
+2. **Get API Keys:**
+   - For Claude: Sign up at [Anthropic Console](https://console.anthropic.com/)
+   - For OpenAI: Sign up at [OpenAI Platform](https://platform.openai.com/)
+
+3. **Install Required Libraries:**
+   ```bash
+   # For Claude
+   pip install anthropic
+
+   # For OpenAI
+   pip install openai
+   ```
+
+4. **Configure Settings:**
+   - Enable AI-Enhanced Analysis
+   - Select your preferred service
+   - Enter your API key
+   - Save settings
+
+5. **Start Analyzing:**
+   - Go back to the main page
+   - Upload a scalp image
+   - The AI will provide detailed analysis
+
+### 💡 Tips
+- **Combine Results**: Enable this for best accuracy - AI + local analysis
+- **Language**: Choose your preferred language for results
+- **Security**: API keys are stored in session only; "Remember settings on this machine" is available only on local single-user installs started with `SCALP_REMEMBER_SETTINGS=1`
+
+### 💰 Pricing
+- **Claude**: ~$0.01-0.03 per image analysis
+- **GPT-4 Vision**: ~$0.01-0.02 per image analysis
+- **Local Analysis**: Free
+"""
 
 # Main UI
 st.title("🤖 AI Service Configuration")
 st.markdown("---")
 
-# Load current configuration
-config = load_api_keys()
+# Load current configuration (session state, else saved config file, else environment)
+if 'ai_config' not in st.session_state:
+    st.session_state['ai_config'] = load_saved_config() or default_ai_config()
+config = st.session_state['ai_config']
 
 # Service availability check
 st.subheader("📊 Service Availability")
-services = AIServiceManager.get_available_services()
-
-cols = st.columns(3)
-for idx, (service, available) in enumerate(services.items()):
-    with cols[idx % 3]:
-        if available:
-            st.success(f"✅ {service}")
-        else:
-            st.warning(f"⚠️ {service} (Needs installation)")
+services = get_cached_services()
+service_names = tuple(services)
+try:
+    default_service_index = service_names.index(config.get('service', 'Local Analysis (Rule-based)'))
+except ValueError:
+    # 已保存的服务不在可用列表中（例如对应库未安装）
+    default_service_index = 0
+
+# 状态卡片拼成一个HTML块一次输出（替代columns + 多个success/warning元素）
+STATUS_CARD_STYLE = "flex: 1; padding: 0.75rem 1rem; border-radius: 0.5rem;"
+st.markdown(
+    "<div style='display: flex; gap: 1rem; margin-bottom: 1rem;'>"
+    + "".join(
+        f"<div style='{STATUS_CARD_STYLE} background: rgba(33, 195, 84, 0.1); color: #177233;'>✅ {service}</div>"
+        if available else
+        f"<div style='{STATUS_CARD_STYLE} background: rgba(255, 189, 69, 0.15); color: #926c05;'>⚠️ {service} (Needs installation)</div>"
+        for service, available in services.items()
+    )
+    + "</div>",
+    unsafe_allow_html=True
+)
 
 st.markdown("---")
 
 # AI Service Selection
-st.subheader("⚙️ AI Service Settings")
-
-col1, col2 = st.columns(2)
-
-with col1:
-    # Enable AI enhancement
-    enable_ai = st.checkbox(
-        "Enable AI-Enhanced Analysis",
-        value=config.get('enable_ai', False),
-        help="Use AI services for more accurate scalp analysis"
-    )
+# 所有设置放在一个表单里：修改控件不会触发重跑，只有点击保存时才提交一次
+with st.form("ai_settings"):
+    st.subheader("⚙️ AI Service Settings")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        # Enable AI enhancement
+        enable_ai = st.checkbox(
+            "Enable AI-Enhanced Analysis",
+            value=config.get('enable_ai', False),
+            help="Use AI services for more accurate scalp analysis"
+        )
 
-    if enable_ai:
         # Select AI service
         selected_service = st.selectbox(
             "Select AI Service",
-            list(services.keys()),
-            index=list(services.keys()).index(config.get('service', 'Local Analysis (Rule-based)')),
-            help="Choose which AI service to use for analysis"
+            service_names,
+            index=default_service_index,
+            help="Choose which AI service to use for analysis (used when AI is enabled)"
         )
 
         # Combine with local analysis
@@ -91,36 +252,30 @@ with col1:
             value=config.get('combine_results', True),
             help="Combine AI results with rule-based local analysis for better accuracy"
         )
-    else:
-        selected_service = "Local Analysis (Rule-based)"
-        combine_results = False
-
-with col2:
-    # Language preference
-    language = st.selectbox(
-        "Analysis Language",
-        ["Chinese (中文)", "English"],
-        index=0 if config.get('language', 'zh') == 'zh' else 1,
-        help="Language for AI analysis results"
-    )
-    language_code = 'zh' if language == "Chinese (中文)" else 'en'
 
-st.markdown("---")
+    with col2:
+        # Language preference
+        language = st.selectbox(
+            "Analysis Language",
+            ["Chinese (中文)", "English"],
+            index=0 if config.get('language', 'zh') == 'zh' else 1,
+            help="Language for AI analysis results"
+        )
 
-# API Key Configuration
-# Initialize both key variables to prevent NameError
-claude_key = config.get('claude_api_key', '')
-openai_key = config.get('openai_api_key', '')
+    st.markdown("---")
 
-if enable_ai:
+    # API Key Configuration
+    # 表单内无法随所选服务动态切换，因此列出所有AI服务的密钥输入框
     st.subheader("🔑 API Key Configuration")
+    claude_key = config.get('claude_api_key', '')
+    openai_key = config.get('openai_api_key', '')
 
-    if selected_service == "Claude (Anthropic)":
+    if "Claude (Anthropic)" in services:
         st.info("📝 Get your Claude API key from: https://console.anthropic.com/")
 
         claude_key = st.text_input(
             "Claude API Key",
-            value=config.get('claude_api_key', ''),
+            value=claude_key,
             type="password",
             placeholder="sk-ant-api03-..."
         )
@@ -130,12 +285,12 @@ if enable_ai:
             st.warning("⚠️ Please install anthropic library:")
             st.code("pip install anthropic", language="bash")
 
-    elif selected_service == "GPT-4 Vision (OpenAI)":
+    if "GPT-4 Vision (OpenAI)" in services:
         st.info("📝 Get your OpenAI API key from: https://platform.openai.com/api-keys")
 
         openai_key = st.text_input(
             "OpenAI API Key",
-            value=config.get('openai_api_key', ''),
+            value=openai_key,
             type="password",
             placeholder="sk-..."
         )
@@ -145,73 +300,48 @@ if enable_ai:
             st.warning("⚠️ Please install openai library:")
             st.code("pip install openai", language="bash")
 
-st.markdown("---")
+    st.markdown("---")
 
-# Save Configuration
-col1, col2, col3 = st.columns([2, 1, 2])
-with col2:
-    if st.button("💾 Save Settings", type="primary", use_container_width=True):
-        # Prepare configuration
-        new_config = {
-            'service': selected_service if enable_ai else 'Local Analysis (Rule-based)',
-            'claude_api_key': claude_key,
-            'openai_api_key': openai_key,
-            'enable_ai': enable_ai,
-            'combine_results': combine_results,
-            'language': language_code
-        }
-
-        # Save configuration
-        save_api_keys(new_config)
+    # Save Configuration
+    remember_settings = REMEMBER_SETTINGS_ENABLED and st.checkbox(
+        "Remember settings on this machine",
+        value=os.path.exists(AI_CONFIG_PATH),
+        help=f"Save settings (including API keys) to {AI_CONFIG_PATH}. Uncheck and save to delete the file."
+    )
+
+    col1, col2, col3 = st.columns([2, 1, 2])
+    with col2:
+        submitted = st.form_submit_button("💾 Save Settings", type="primary", use_container_width=True)
+
+language_code = 'zh' if language == "Chinese (中文)" else 'en'
+if not enable_ai:
+    selected_service = "Local Analysis (Rule-based)"
+    combine_results = False
+
+if submitted:
+    # Prepare configuration
+    new_config = {
+        'service': selected_service,
+        'claude_api_key': claude_key,
+        'openai_api_key': openai_key,
+        'enable_ai': enable_ai,
+        'combine_results': combine_results,
+        'language': language_code
+    }
+
+    # Save configuration
+    try:
+        save_api_keys(new_config, persist=remember_settings)
         st.success("✅ Settings saved successfully!")
         st.balloons()
+    except OSError as e:
+        st.warning(f"⚠️ Settings saved for this session, but the config file could not be written: {e}")
 
 st.markdown("---")
 
 # Usage Instructions
 with st.expander("📖 How to Use AI Services", expanded=False):
-    st.markdown("""
-    ### 🚀 Quick Start Guide
-
-    1. **Choose an AI Service:**
-       - **Claude (Anthropic)**: Best for detailed medical analysis with high accuracy
-       - **GPT-4 Vision (OpenAI)**: Good for general scalp analysis with fast response
-       - **Local Analysis**: Free rule-based analysis without API requirements
-
-    2. **Get API Keys:**
-       - For Claude: Sign up at [Anthropic Console](https://console.anthropic.com/)
-       - For OpenAI: Sign up at [OpenAI Platform](https://platform.openai.com/)
-
-    3. **Install Required Libraries:**
-       ```bash
-       # For Claude
-       pip install anthropic
-
-       # For OpenAI
-       pip install openai
-       ```
-
-    4. **Configure Settings:**
-       - Enable AI-Enhanced Analysis
-       - Select your preferred service
-       - Enter your API key
-       - Save settings
-
-    5. **Start Analyzing:**
-       - Go back to the main page
-       - Upload a scalp image
-       - The AI will provide detailed analysis
-
-    ### 💡 Tips
-    - **Combine Results**: Enable this for best accuracy - AI + local analysis
-    - **Language**: Choose your preferred language for results
-    - **Security**: API keys are stored in session only (not saved to disk)
-
-    ### 💰 Pricing
-    - **Claude**: ~$0.01-0.03 per image analysis
-    - **GPT-4 Vision**: ~$0.01-0.02 per image analysis
-    - **Local Analysis**: Free
-    """)
+    st.markdown(USAGE_GUIDE_MD)
 
 # Testing Section
 with st.expander("🧪 Test AI Connection", expanded=False):
@@ -230,19 +360,7 @@ with st.expander("🧪 Test AI Connection", expanded=False):
                             else:
                                 # 实际测试API连接
                                 try:
-                                    from anthropic import Anthropic
-                                    client = Anthropic(api_key=claude_key)
-
-                                    # 发送测试请求
-                                    message = client.messages.create(
-                                        model="claude-3-haiku-20240307",  # 使用可用的Haiku模型
-                                        max_tokens=50,
-                                        messages=[
-                                            {"role": "user", "content": "Say 'API test successful' in Chinese"}
-                                        ]
-                                    )
-
-                                    response = message.content[0].text
+                                    response = probe_claude(claude_key)
                                     st.success("✅ Claude API连接成功!")
                                     st.info(f"测试响应: {response}")
                                     st.balloons()
@@ -250,13 +368,14 @@ with st.expander("🧪 Test AI Connection", expanded=False):
                                     error_msg = str(api_error)
                                     st.error(f"❌ API连接失败: {error_msg}")
 
-                                    # 提供具体建议
-                                    if "authentication" in error_msg.lower() or "api_key" in error_msg.lower():
+                                    # 提供具体建议（一次正则扫描完成错误归类）
+                                    error_kind = classify_api_error(error_msg)
+                                    if error_kind == 'auth':
                                         st.warning("🔑 API密钥无效，请检查密钥是否正确")
                                         st.info("获取新密钥: https://console.anthropic.com/")
-                                    elif "rate" in error_msg.lower() or "quota" in error_msg.lower():
+                                    elif error_kind == 'rate':
                                         st.warning("⏰ API配额已用完，请检查账户余额")
-                                    elif "network" in error_msg.lower():
+                                    elif error_kind == 'network':
                                         st.warning("🌐 网络连接问题，请检查网络")
                                     else:
                                         with st.expander("查看详细错误"):
@@ -268,41 +387,15 @@ with st.expander("🧪 Test AI Connection", expanded=False):
                             else:
                                 # 实际测试OpenAI API
                                 try:
-                                    from openai import OpenAI
-                                    client = OpenAI(api_key=openai_key)
-
-                                    # 尝试多个模型进行测试
-                                    models_to_test = ["gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"]
-                                    success = False
-                                    used_model = None
-
-                                    for model in models_to_test:
-                                        try:
-                                            response = client.chat.completions.create(
-                                                model=model,
-                                                messages=[
-                                                    {"role": "user", "content": "Say 'API test successful'"}
-                                                ],
-                                                max_tokens=20
-                                            )
-                                            result = response.choices[0].message.content
-                                            used_model = model
-                                            success = True
-                                            break
-                                        except Exception as e:
-                                            if "model_not_found" in str(e) or "does not exist" in str(e):
-                                                continue
-                                            else:
-                                                raise e
-
-                                    if success:
-                                        st.success(f"✅ OpenAI API连接成功! (使用模型: {used_model})")
-                                        st.info(f"测试响应: {result}")
-                                        st.balloons()
-                                    else:
-                                        st.error("❌ 所有测试的模型都不可用")
-                                        st.warning("您的账户可能没有访问这些模型的权限")
+                                    used_model, result = probe_openai(openai_key)
+
+                                    st.success(f"✅ OpenAI API连接成功! (使用模型: {used_model})")
+                                    st.info(f"测试响应: {result}")
+                                    st.balloons()
 
+                                except NoModelAvailableError as no_model_error:
+                                    st.error(f"❌ {no_model_error}")
+                                    st.warning("您的账户可能没有访问这些模型的权限")
                                 except Exception as api_error:
                                     st.error(f"❌ API连接失败: {str(api_error)}")
                                     with st.expander("查看详细错误"):
@@ -321,8 +414,8 @@ else:
 
 st.sidebar.markdown("### 📝 Notes")
 st.sidebar.markdown("""
-- API keys are not permanently saved
-- Set as environment variables for persistence
+- API keys are kept in session only (local installs can opt in to "Remember settings" with SCALP_REMEMBER_SETTINGS=1)
+- Or set as environment variables for persistence
 - Costs apply for AI services
 - Local analysis is always free
 """)
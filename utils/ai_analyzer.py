@@ -3,10 +3,15 @@
 Medical-Grade Enhanced AI Analysis Module for Scalp Health
 使用多维度图像分析提供专业医学级诊断
 """
+import copy
+import hashlib
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+
 import cv2
 import numpy as np
-from PIL import Image
-from scipy import ndimage
 
 try:
     # Try relative import first (for package imports)
@@ -19,13 +24,35 @@ except ImportError:
         # 如果详细分析器不可用，设置为None
         DetailedScalpAnalyzer = None
 
-def is_scalp_image(img_array, img_hsv):
+# 特征分析使用的最长边（更大的图片先等比缩小，所有O(H·W)的步骤随之变快）
+ANALYSIS_MAX_SIDE = 512
+
+# 分析结果缓存（LRU）：同一张图片预览后再确认分析时直接返回，{图像内容哈希: 分析结果}
+ANALYSIS_CACHE_SIZE = 64
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+def resize_for_analysis(img_array, max_side=ANALYSIS_MAX_SIDE):
+    """把图像等比缩小到最长边不超过max_side（INTER_AREA），不超过时原样返回"""
+    height, width = img_array.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return img_array
+    return cv2.resize(img_array, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def mask_percentage(mask):
+    """二值掩码（inRange/Canny/形态学输出）中前景像素的百分比"""
+    # count_nonzero直接统计非零字节，省去 >0 比较产生的布尔临时数组
+    return np.count_nonzero(mask) / mask.size * 100
+
+def is_scalp_image(img_array, img_hsv, img_gray):
     """
     验证图像是否为头皮照片
 
     参数:
         img_array: RGB图像数组
         img_hsv: HSV图像数组
+        img_gray: 灰度图像数组
 
     返回:
         tuple: (是否为头皮图像, 置信度)
@@ -41,12 +68,11 @@ def is_scalp_image(img_array, img_hsv):
     skin_mask2 = cv2.inRange(img_hsv, lower_skin2, upper_skin2)
 
     combined_mask = cv2.bitwise_or(skin_mask, skin_mask2)
-    skin_percentage = np.sum(combined_mask > 0) / combined_mask.size * 100
+    skin_percentage = mask_percentage(combined_mask)
 
     # 检查是否有足够的纹理（毛发特征）
-    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    edges = cv2.Canny(gray, 30, 100)
-    edge_density = np.sum(edges > 0) / edges.size * 100
+    edges = cv2.Canny(img_gray, 30, 100)
+    edge_density = mask_percentage(edges)
 
     # 检查颜色分布是否自然
     color_std = np.std(img_array)
@@ -83,18 +109,50 @@ def analyze_scalp_image(image):
     返回:
         dict: 包含头皮类型、疾病诊断、问题、置信度等信息
     """
-    # 转换为numpy数组
-    img_array = np.array(image)
+    # 转换为numpy数组（asarray省去np.array的额外拷贝；结果只读，后续只作为OpenCV输入）
+    img_array = np.ascontiguousarray(np.asarray(image))
+
+    # 按像素内容精确匹配（不用感知哈希，避免相似但不同的图片复用诊断结果）
+    cache_key = image_cache_key(img_array)
+    with _analysis_cache_lock:
+        cached = _analysis_cache.get(cache_key)
+        if cached is not None:
+            _analysis_cache.move_to_end(cache_key)
+    if cached is not None:
+        # 调用方会修改返回的结果，始终交出副本
+        return copy.deepcopy(cached)
+
+    result = analyze_image_array(img_array)
+
+    with _analysis_cache_lock:
+        _analysis_cache[cache_key] = copy.deepcopy(result)
+        if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return result
+
+def image_cache_key(img_array):
+    """图像内容哈希（形状+类型+像素字节），用作分析结果缓存的键"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img_array.shape}{img_array.dtype}".encode())
+    digest.update(np.ascontiguousarray(img_array))
+    return digest.digest()
 
+def analyze_image_array(img_array):
+    """对numpy图像数组执行完整分析（analyze_scalp_image的无缓存实现）"""
     # 确保是RGB格式
     if len(img_array.shape) == 2:
         img_array = cv2.cvtColor(img_array, cv2.COLOR_GRAY2RGB)
 
-    # 转换到HSV色彩空间
-    img_hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
+    # 验证和特征提取在缩小后的图像上进行（各项特征都是百分比/均值，不依赖分辨率）
+    # 详细分析仍使用原图，保证红点/鳞屑等坐标对应原图
+    analysis_img = resize_for_analysis(img_array)
+
+    # 转换到HSV色彩空间和灰度（各只转换一次，后续验证、特征提取共用）
+    img_hsv = cv2.cvtColor(analysis_img, cv2.COLOR_RGB2HSV)
+    img_gray = cv2.cvtColor(analysis_img, cv2.COLOR_RGB2GRAY)
 
     # ===== 验证是否为头皮图像 =====
-    is_scalp, validation_confidence = is_scalp_image(img_array, img_hsv)
+    is_scalp, validation_confidence = is_scalp_image(analysis_img, img_hsv, img_gray)
 
     if not is_scalp:
         # 如果不是头皮图像，返回警告信息
@@ -124,19 +182,17 @@ def analyze_scalp_image(image):
         }
 
     # 继续正常的分析流程
-    img_gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-
     # ===== 1. 多维度特征提取 =====
-    features = extract_scalp_features(img_array, img_hsv, img_gray)
+    features = extract_scalp_features(analysis_img, img_hsv, img_gray)
 
     # ===== 2. 头皮类型判断 =====
     scalp_type, type_score = determine_scalp_type(features)
 
     # ===== 3. 医学疾病诊断 =====
-    diagnosed_conditions = diagnose_medical_conditions(features, img_array, img_hsv, img_gray)
+    diagnosed_conditions = diagnose_medical_conditions(features, analysis_img, img_hsv, img_gray)
 
     # ===== 4. 健康问题检测 =====
-    concerns = detect_scalp_concerns(features, img_array, img_hsv, img_gray)
+    concerns = detect_scalp_concerns(features, analysis_img, img_hsv, img_gray)
 
     # ===== 5. 综合健康评分 =====
     health_score = calculate_health_score(features, concerns, diagnosed_conditions)
@@ -149,16 +205,16 @@ def analyze_scalp_image(image):
 
     # ===== 8. 详细分析数据 =====
     details = {
-        'brightness': round(features['brightness'], 2),
-        'saturation': round(features['saturation'], 2),
-        'contrast': round(features['contrast'], 2),
-        'sharpness': round(features['sharpness'], 2),
-        'texture_quality': round(features['texture_quality'], 2),
-        'hair_density': round(features['hair_density'], 2),
-        'redness_level': round(features['redness_level'], 2),
-        'dandruff_level': round(features['dandruff_level'], 2),
-        'inflammation_level': round(features.get('inflammation_level', 0), 2),
-        'bald_spots_detected': features.get('bald_spots_count', 0)
+        'brightness': round(features.brightness, 2),
+        'saturation': round(features.saturation, 2),
+        'contrast': round(features.contrast, 2),
+        'sharpness': round(features.sharpness, 2),
+        'texture_quality': round(features.texture_quality, 2),
+        'hair_density': round(features.hair_density, 2),
+        'redness_level': round(features.redness_level, 2),
+        'dandruff_level': round(features.dandruff_level, 2),
+        'inflammation_level': round(features.inflammation_level, 2),
+        'bald_spots_detected': features.bald_spots_count
     }
 
     # ===== 9. 执行详细分析（如果可用）=====
@@ -209,11 +265,10 @@ def analyze_scalp_image(image):
         # FALLBACK: 如果detailed_analysis失败，直接调用检测函数
         print("[FALLBACK] detailed_analysis is None, calling detection functions directly")
         try:
-            # 直接调用检测函数
-            img_hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-
-            red_dots = DetailedScalpAnalyzer._detect_red_dots(img_array, img_hsv)
-            white_flakes = DetailedScalpAnalyzer._detect_white_flakes(img_array, img_hsv)
+            # 直接调用检测函数（原图未缩小时复用上面已转换的HSV图像）
+            full_hsv = img_hsv if analysis_img is img_array else cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
+            red_dots = DetailedScalpAnalyzer._detect_red_dots(img_array, full_hsv)
+            white_flakes = DetailedScalpAnalyzer._detect_white_flakes(img_array, full_hsv)
             follicle_info = DetailedScalpAnalyzer._detect_follicle_density(img_array)
 
             result['red_dots'] = red_dots
@@ -231,115 +286,163 @@ def analyze_scalp_image(image):
 
     return result
 
+@dataclass(slots=True)
+class ScalpFeatures:
+    """extract_scalp_features 提取的多维度特征（百分比/0-100分数，亮度类为0-255均值）"""
+    brightness: float
+    saturation: float
+    value: float
+    contrast: float
+    sharpness: float
+    texture_quality: float
+    hair_density: float
+    redness_level: float
+    dandruff_level: float
+    oiliness: float
+    color_uniformity: float
+    healthy_color_ratio: float
+    # 医学级检测
+    inflammation_level: float
+    bald_spots_count: int
+    bald_spots_size: float
+    yellow_patches: float
+    red_patches: float
+    circular_pattern: int
+    scalp_scales: float
+    folliculitis_points: int
+    hairline_recession: float
+
 def extract_scalp_features(img_rgb, img_hsv, img_gray):
     """提取头皮图像的多维度特征"""
-    features = {}
-
-    # 1. 基础色彩特征
-    features['brightness'] = np.mean(img_gray)
-    features['saturation'] = np.mean(img_hsv[:, :, 1])
-    features['value'] = np.mean(img_hsv[:, :, 2])
+    # 1. 基础色彩特征（meanStdDev一次遍历同时得到均值和标准差，HSV三个通道一次调用）
+    gray_mean, gray_std = cv2.meanStdDev(img_gray)
+    hsv_mean, _ = cv2.meanStdDev(img_hsv)
+    brightness = float(gray_mean[0, 0])
+    saturation = float(hsv_mean[1, 0])
+    value = float(hsv_mean[2, 0])
 
     # 2. 对比度（标准差）
-    features['contrast'] = np.std(img_gray)
+    contrast = float(gray_std[0, 0])
 
     # 3. 清晰度（拉普拉斯算子）
-    laplacian = cv2.Laplacian(img_gray, cv2.CV_64F)
-    features['sharpness'] = np.var(laplacian)
+    # uint8输入的3x3拉普拉斯响应是小整数，float32可精确表示，内存带宽只有float64的一半
+    laplacian = cv2.Laplacian(img_gray, cv2.CV_32F)
+    sharpness = np.var(laplacian, dtype=np.float64)
 
     # 4. 纹理质量（局部二值模式）
-    features['texture_quality'] = calculate_texture_score(img_gray)
+    texture_quality = calculate_texture_score(img_gray)
 
     # 5. 头发密度（边缘检测）
     edges = cv2.Canny(img_gray, 50, 150)
-    features['hair_density'] = np.sum(edges > 0) / edges.size * 100
+    hair_density = mask_percentage(edges)
 
-    # 6. 红色程度（炎症指标）
-    features['redness_level'] = calculate_redness(img_rgb, img_hsv)
+    # 6. 红色程度（炎症指标）；三种红色掩码一次查表得到，供红色程度/红斑/毛囊炎共用
+    redness_mask, red_patch_mask, folliculitis_mask = compute_red_masks(img_hsv)
+    redness_level = calculate_redness(redness_mask)
 
     # 7. 头屑检测（白色斑点）
-    features['dandruff_level'] = detect_dandruff(img_hsv, img_gray)
+    dandruff_level = detect_dandruff(img_hsv, img_gray)
 
-    # 8. 油脂程度（亮度+饱和度综合）
-    features['oiliness'] = calculate_oiliness(img_rgb, img_hsv)
+    # 8. 油脂程度（亮度+饱和度综合，复用上面的通道均值）
+    oiliness = calculate_oiliness(value, saturation)
 
     # 9. 色彩均匀度
-    features['color_uniformity'] = calculate_color_uniformity(img_rgb)
+    color_uniformity = calculate_color_uniformity(img_rgb)
 
     # 10. 头皮健康色（粉红/肉色检测）
-    features['healthy_color_ratio'] = detect_healthy_skin_color(img_rgb, img_hsv)
+    healthy_color_ratio = detect_healthy_skin_color(img_rgb, img_hsv)
 
     # ===== 新增医学级检测 =====
 
-    # 11. 炎症程度（综合红色+肿胀）
-    features['inflammation_level'] = calculate_inflammation_level(img_rgb, img_hsv)
+    # 11. 炎症程度（综合红色+肿胀，复用已算出的红色程度和亮度）
+    inflammation_level = calculate_inflammation_level(redness_level, value)
 
     # 12. 斑秃/秃斑检测（局部脱发区域）
-    features['bald_spots_count'], features['bald_spots_size'] = detect_bald_spots(img_gray, edges)
+    bald_spots_count, bald_spots_size = detect_bald_spots(img_gray, edges)
 
     # 13. 黄色区域检测（脂溢性皮炎）
-    features['yellow_patches'] = detect_yellow_patches(img_hsv)
+    yellow_patches = detect_yellow_patches(img_hsv)
 
     # 14. 红色斑块（银屑病/牛皮癣）
-    features['red_patches'] = detect_red_patches(img_hsv, img_rgb)
+    red_patches = detect_red_patches(red_patch_mask)
 
     # 15. 圆形脱发斑（斑秃特征）
-    features['circular_pattern'] = detect_circular_hair_loss(img_gray)
+    circular_pattern = detect_circular_hair_loss(img_gray, hair_density, texture_quality)
 
     # 16. 头皮鳞屑（银屑病、头癣）
-    features['scalp_scales'] = detect_scalp_scales(img_gray, img_hsv)
+    scalp_scales = detect_scalp_scales(img_gray, laplacian)
 
     # 17. 毛囊炎症（红色小点）
-    features['folliculitis_points'] = detect_folliculitis(img_rgb, img_hsv)
+    folliculitis_points = detect_folliculitis(folliculitis_mask)
 
     # 18. 发际线后移程度
-    features['hairline_recession'] = detect_hairline_recession(img_gray, edges)
-
-    return features
+    hairline_recession = detect_hairline_recession(edges, hair_density)
+
+    return ScalpFeatures(
+        brightness=brightness, saturation=saturation, value=value, contrast=contrast,
+        sharpness=sharpness, texture_quality=texture_quality, hair_density=hair_density,
+        redness_level=redness_level, dandruff_level=dandruff_level, oiliness=oiliness,
+        color_uniformity=color_uniformity, healthy_color_ratio=healthy_color_ratio,
+        inflammation_level=inflammation_level, bald_spots_count=bald_spots_count,
+        bald_spots_size=bald_spots_size, yellow_patches=yellow_patches, red_patches=red_patches,
+        circular_pattern=circular_pattern, scalp_scales=scalp_scales,
+        folliculitis_points=folliculitis_points, hairline_recession=hairline_recession,
+    )
 
 def calculate_texture_score(img_gray):
     """计算纹理质量分数（头发密度和清晰度）"""
-    sobelx = cv2.Sobel(img_gray, cv2.CV_64F, 1, 0, ksize=3)
-    sobely = cv2.Sobel(img_gray, cv2.CV_64F, 0, 1, ksize=3)
-    sobel = np.sqrt(sobelx**2 + sobely**2)
-    texture_strength = np.mean(sobel)
+    sobelx = cv2.Sobel(img_gray, cv2.CV_32F, 1, 0, ksize=3)
+    sobely = cv2.Sobel(img_gray, cv2.CV_32F, 0, 1, ksize=3)
+    sobel = cv2.magnitude(sobelx, sobely)
+    texture_strength = np.mean(sobel, dtype=np.float64)
     return min(texture_strength / 2, 100)
 
-def calculate_redness(img_rgb, img_hsv):
-    """计算红色程度（炎症、敏感指标）"""
-    lower_red1 = np.array([0, 50, 50])
-    upper_red1 = np.array([10, 255, 255])
-    lower_red2 = np.array([160, 50, 50])
-    upper_red2 = np.array([180, 255, 255])
+# 红色色相查找表：bit0 = 红色色相（0-10 或 160-180），bit1 = 低端红色（0-10，毛囊炎只看这一段）
+RED_HUE_LUT = np.zeros(256, np.uint8)
+RED_HUE_LUT[0:11] = 3
+RED_HUE_LUT[160:181] = 1
+
+def compute_red_masks(img_hsv):
+    """
+    一次查表得到三种红色掩码（替代5次inRange全图扫描）
+
+    返回:
+        tuple: (红色程度掩码 S,V>=50, 红斑掩码 S,V>=80, 毛囊炎掩码 H<=10且S,V>=100)
+    """
+    hue, sat, val = cv2.split(img_hsv)
+    hue_flags = cv2.LUT(hue, RED_HUE_LUT)
+    # S和V的阈值总是相同，取两者较小值后只需比较一次
+    sv_min = cv2.min(sat, val)
 
-    mask1 = cv2.inRange(img_hsv, lower_red1, upper_red1)
-    mask2 = cv2.inRange(img_hsv, lower_red2, upper_red2)
-    red_mask = mask1 + mask2
+    red_hue = cv2.compare(hue_flags, 0, cv2.CMP_GT)
+    low_red_hue = cv2.compare(hue_flags, 2, cv2.CMP_GE)
 
-    red_percentage = np.sum(red_mask > 0) / red_mask.size * 100
+    redness_mask = cv2.bitwise_and(red_hue, cv2.compare(sv_min, 50, cv2.CMP_GE))
+    red_patch_mask = cv2.bitwise_and(red_hue, cv2.compare(sv_min, 80, cv2.CMP_GE))
+    folliculitis_mask = cv2.bitwise_and(low_red_hue, cv2.compare(sv_min, 100, cv2.CMP_GE))
+    return redness_mask, red_patch_mask, folliculitis_mask
+
+def calculate_redness(red_mask):
+    """计算红色程度（炎症、敏感指标）"""
+    red_percentage = mask_percentage(red_mask)
     return red_percentage
 
 def detect_dandruff(img_hsv, img_gray):
     """检测头屑（白色斑点）"""
-    _, bright_thresh = cv2.threshold(img_gray, 200, 255, cv2.THRESH_BINARY)
-    low_saturation = img_hsv[:, :, 1] < 30
-    dandruff_mask = np.logical_and(bright_thresh > 0, low_saturation)
-    dandruff_percentage = np.sum(dandruff_mask) / dandruff_mask.size * 100
+    # 高亮且低饱和度的像素，一个布尔表达式直接计数
+    dandruff_mask = (img_gray > 200) & (img_hsv[:, :, 1] < 30)
+    dandruff_percentage = np.count_nonzero(dandruff_mask) / dandruff_mask.size * 100
     return dandruff_percentage
 
-def calculate_oiliness(img_rgb, img_hsv):
-    """计算油脂程度"""
-    brightness = np.mean(img_hsv[:, :, 2])
-    saturation = np.mean(img_hsv[:, :, 1])
+def calculate_oiliness(brightness, saturation):
+    """计算油脂程度（参数为HSV的V、S通道均值）"""
     oiliness_score = (brightness / 255 * 0.6 + saturation / 255 * 0.4) * 100
     return oiliness_score
 
 def calculate_color_uniformity(img_rgb):
     """计算颜色均匀度"""
-    r_std = np.std(img_rgb[:, :, 0])
-    g_std = np.std(img_rgb[:, :, 1])
-    b_std = np.std(img_rgb[:, :, 2])
-    avg_std = (r_std + g_std + b_std) / 3
+    _, rgb_std = cv2.meanStdDev(img_rgb)
+    avg_std = float(rgb_std[:3, 0].sum()) / 3
     uniformity = max(0, 100 - avg_std / 2)
     return uniformity
 
@@ -348,36 +451,44 @@ def detect_healthy_skin_color(img_rgb, img_hsv):
     lower_skin = np.array([0, 20, 70])
     upper_skin = np.array([25, 170, 255])
     skin_mask = cv2.inRange(img_hsv, lower_skin, upper_skin)
-    healthy_ratio = np.sum(skin_mask > 0) / skin_mask.size * 100
+    healthy_ratio = mask_percentage(skin_mask)
     return healthy_ratio
 
 # ===== 新增医学级检测函数 =====
 
-def calculate_inflammation_level(img_rgb, img_hsv):
-    """计算炎症程度（综合指标）"""
-    # 红色区域
-    redness = calculate_redness(img_rgb, img_hsv)
-
-    # 亮度异常（肿胀）
-    brightness = np.mean(img_hsv[:, :, 2])
-
+def calculate_inflammation_level(redness, brightness):
+    """计算炎症程度（综合指标：红色区域比例 + 亮度异常/肿胀）"""
     # 综合炎症指数
     inflammation = (redness * 0.7 + (brightness / 255 * 30) * 0.3)
 
     return inflammation
 
+def percentile_threshold(values, q):
+    """
+    与np.percentile(values, q)（线性插值）结果相同的分位数
+
+    只用一次np.partition选出相邻两个顺序统计量再插值，
+    省去np.percentile的额外拷贝和两次选择
+    """
+    flat = values.ravel()
+    k, rem = divmod((flat.size - 1) * q, 100)
+    k_next = min(k + 1, flat.size - 1)
+    selected = np.partition(flat, (k, k_next))
+    low, high = float(selected[k]), float(selected[k_next])
+    return low + (high - low) * rem / 100
+
 def detect_bald_spots(img_gray, edges):
     """检测斑秃/秃斑（局部脱发区域）"""
-    # 检测低密度区域
-    kernel = np.ones((50, 50), np.uint8)
-    edge_density = cv2.filter2D(edges.astype(float), -1, kernel / kernel.sum())
+    # 检测低密度区域（50x50窗口内的边缘均值；boxFilter用滑动累加，每像素O(1)）
+    edge_density = cv2.boxFilter(edges, cv2.CV_32F, (50, 50))
 
     # 找到密度非常低的区域（可能是秃斑）
-    bald_threshold = np.percentile(edge_density, 20)
+    bald_threshold = percentile_threshold(edge_density, 20)
     bald_mask = edge_density < bald_threshold
 
-    # 计算连通区域
-    labeled, num_spots = ndimage.label(bald_mask)
+    # 计算连通区域（4连通，与原ndimage.label默认结构一致；标签0是背景）
+    num_labels, _ = cv2.connectedComponents(bald_mask.astype(np.uint8), connectivity=4)
+    num_spots = num_labels - 1
 
     # 计算秃斑总面积
     total_bald_area = np.sum(bald_mask) / bald_mask.size * 100
@@ -391,32 +502,26 @@ def detect_yellow_patches(img_hsv):
     upper_yellow = np.array([35, 255, 255])
 
     yellow_mask = cv2.inRange(img_hsv, lower_yellow, upper_yellow)
-    yellow_percentage = np.sum(yellow_mask > 0) / yellow_mask.size * 100
+    yellow_percentage = mask_percentage(yellow_mask)
 
     return yellow_percentage
 
-def detect_red_patches(img_hsv, img_rgb):
-    """检测大片红色斑块（银屑病/牛皮癣）"""
-    # 检测饱和度较高的红色
-    lower_red1 = np.array([0, 80, 80])
-    upper_red1 = np.array([10, 255, 255])
-    lower_red2 = np.array([160, 80, 80])
-    upper_red2 = np.array([180, 255, 255])
-
-    mask1 = cv2.inRange(img_hsv, lower_red1, upper_red1)
-    mask2 = cv2.inRange(img_hsv, lower_red2, upper_red2)
-    red_mask = mask1 + mask2
-
+def detect_red_patches(red_mask):
+    """检测大片红色斑块（银屑病/牛皮癣）；red_mask为饱和度较高的红色掩码"""
     # 使用形态学操作找连续区域
     kernel = np.ones((15, 15), np.uint8)
     red_patches = cv2.morphologyEx(red_mask, cv2.MORPH_CLOSE, kernel)
 
-    red_patch_percentage = np.sum(red_patches > 0) / red_patches.size * 100
+    red_patch_percentage = mask_percentage(red_patches)
 
     return red_patch_percentage
 
-def detect_circular_hair_loss(img_gray):
+def detect_circular_hair_loss(img_gray, hair_density, texture_quality):
     """检测圆形脱发斑（斑秃典型特征）"""
+    # 几乎没有边缘/纹理的图像（纯色、过度模糊）不可能有头发包围的脱发斑，跳过最耗时的霍夫圆检测
+    if hair_density < 3 or texture_quality < 5:
+        return 0
+
     # 使用霍夫圆检测
     blurred = cv2.GaussianBlur(img_gray, (9, 9), 2)
     circles = cv2.HoughCircles(blurred, cv2.HOUGH_GRADIENT, dp=1, minDist=50,
@@ -426,48 +531,33 @@ def detect_circular_hair_loss(img_gray):
         return len(circles[0])
     return 0
 
-def detect_scalp_scales(img_gray, img_hsv):
-    """检测头皮鳞屑（银屑病、头癣）"""
-    # 检测高亮+粗糙纹理
-    _, bright = cv2.threshold(img_gray, 180, 255, cv2.THRESH_BINARY)
-
-    # 检测纹理
-    laplacian = cv2.Laplacian(img_gray, cv2.CV_64F)
-    rough_texture = np.abs(laplacian) > 30
-
-    # 结合两者
-    scales_mask = np.logical_and(bright > 0, rough_texture)
-    scales_percentage = np.sum(scales_mask) / scales_mask.size * 100
+def detect_scalp_scales(img_gray, laplacian):
+    """检测头皮鳞屑（银屑病、头癣）；laplacian为特征提取时已算好的拉普拉斯响应"""
+    # 高亮 + 粗糙纹理，合并为一个布尔表达式
+    scales_mask = (img_gray > 180) & (np.abs(laplacian) > 30)
+    scales_percentage = np.count_nonzero(scales_mask) / scales_mask.size * 100
 
     return scales_percentage
 
-def detect_folliculitis(img_rgb, img_hsv):
-    """检测毛囊炎（小红点）"""
-    # 检测小的红色区域
-    lower_red = np.array([0, 100, 100])
-    upper_red = np.array([10, 255, 255])
-
-    red_mask = cv2.inRange(img_hsv, lower_red, upper_red)
-
+def detect_folliculitis(red_mask):
+    """检测毛囊炎（小红点）；red_mask为低端色相的高饱和红色掩码"""
     # 形态学操作：保留小点，去除大片
     kernel = np.ones((3, 3), np.uint8)
     red_points = cv2.morphologyEx(red_mask, cv2.MORPH_OPEN, kernel)
 
-    # 计数小红点
-    labeled, num_points = ndimage.label(red_points)
+    # 计数小红点（4连通；标签0是背景）
+    num_labels, _ = cv2.connectedComponents(red_points, connectivity=4)
+    num_points = num_labels - 1
 
     return num_points
 
-def detect_hairline_recession(img_gray, edges):
-    """检测发际线后移"""
-    height = img_gray.shape[0]
+def detect_hairline_recession(edges, overall_density):
+    """检测发际线后移；overall_density为整图头发密度（即features.hair_density）"""
+    height = edges.shape[0]
     top_region = edges[:height//3, :]
 
-    # 计算上部头发密度
-    top_density = np.sum(top_region > 0) / top_region.size * 100
-
-    # 与整体密度对比
-    overall_density = np.sum(edges > 0) / edges.size * 100
+    # 计算上部头发密度，与整体密度对比
+    top_density = mask_percentage(top_region)
 
     recession_score = max(0, (overall_density - top_density) * 2)
 
@@ -475,22 +565,37 @@ def detect_hairline_recession(img_gray, edges):
 
 # ===== 医学疾病诊断 =====
 
+# 单一指标决定的严重程度：阈值升序排列
+# bisect_left 统计严格小于该值的阈值个数（对应原来的 "> 阈值" 判断）
+SEVERITY_LEVELS = ('轻度', '中度', '重度')
+BALD_SPOT_SIZE_THRESHOLDS = (10, 20)        # 斑秃面积 >10 中度，>20 重度
+CONTACT_DERMATITIS_THRESHOLDS = (22,)       # 炎症 >22 中度
+# 雄激素性脱发按密度从低到高：<5 晚期，<10 中期，其余早期（bisect_right 对应 "< 阈值"）
+HAIR_LOSS_STAGES = ('晚期', '中期', '早期')
+HAIR_LOSS_DENSITY_THRESHOLDS = (5, 10)
+
 def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
     """基于特征诊断具体医学疾病（严格版本）"""
     conditions = []
 
+    # 诊断规则反复读取同一批特征，先绑定为局部变量
+    bald_spots_count, bald_spots_size = features.bald_spots_count, features.bald_spots_size
+    hair_density, texture_quality = features.hair_density, features.texture_quality
+    redness_level, inflammation_level = features.redness_level, features.inflammation_level
+    dandruff_level, scalp_scales = features.dandruff_level, features.scalp_scales
+    red_patches, yellow_patches = features.red_patches, features.yellow_patches
+    oiliness, color_uniformity = features.oiliness, features.color_uniformity
+    folliculitis_points, circular_pattern = features.folliculitis_points, features.circular_pattern
+    hairline_recession = features.hairline_recession
+
     # 1. 斑秃 (Alopecia Areata) - 鬼剃头
     # 更严格的条件：必须有明显的秃斑且面积较大
-    if features['bald_spots_count'] >= 2 and features['bald_spots_size'] > 3:
-        severity = "轻度"
-        if features['bald_spots_size'] > 10:
-            severity = "中度"
-        if features['bald_spots_size'] > 20:
-            severity = "重度"
+    if bald_spots_count >= 2 and bald_spots_size > 3:
+        severity = SEVERITY_LEVELS[bisect_left(BALD_SPOT_SIZE_THRESHOLDS, bald_spots_size)]
 
         # 需要圆形特征来提高置信度
         confidence = 65
-        if features['circular_pattern'] > 1:
+        if circular_pattern > 1:
             confidence = 75
 
         conditions.append({
@@ -505,12 +610,8 @@ def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
 
     # 2. 雄激素性脱发 (Androgenetic Alopecia) - 男性/女性型脱发
     # 更严格：需要低密度和明显的发际线后移
-    if features['hair_density'] < 15 and features['hairline_recession'] > 20:
-        severity = "早期"
-        if features['hair_density'] < 10:
-            severity = "中期"
-        if features['hair_density'] < 5:
-            severity = "晚期"
+    if hair_density < 15 and hairline_recession > 20:
+        severity = HAIR_LOSS_STAGES[bisect_right(HAIR_LOSS_DENSITY_THRESHOLDS, hair_density)]
 
         conditions.append({
             'name_cn': '雄激素性脱发',
@@ -524,11 +625,11 @@ def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
 
     # 3. 脂溢性皮炎 (Seborrheic Dermatitis)
     # 更严格：需要多个症状同时存在
-    if features['oiliness'] > 75 and features['yellow_patches'] > 12 and features['dandruff_level'] > 10:
+    if oiliness > 75 and yellow_patches > 12 and dandruff_level > 10:
         severity = "轻度"
-        if features['redness_level'] > 15 and features['inflammation_level'] > 15:
+        if redness_level > 15 and inflammation_level > 15:
             severity = "中度"
-        if features['inflammation_level'] > 25:
+        if inflammation_level > 25:
             severity = "重度"
 
         conditions.append({
@@ -543,11 +644,11 @@ def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
 
     # 4. 毛囊炎 (Folliculitis)
     # 更严格：需要更多红点和明显的炎症
-    if features['folliculitis_points'] > 10 and features['redness_level'] > 12 and features['inflammation_level'] > 10:
+    if folliculitis_points > 10 and redness_level > 12 and inflammation_level > 10:
         severity = "轻度"
-        if features['folliculitis_points'] > 20:
+        if folliculitis_points > 20:
             severity = "中度"
-        if features['inflammation_level'] > 22:
+        if inflammation_level > 22:
             severity = "重度"
 
         conditions.append({
@@ -562,11 +663,11 @@ def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
 
     # 5. 银屑病/牛皮癣 (Psoriasis)
     # 更严格：需要明显的红斑和鳞屑
-    if features['red_patches'] > 15 and features['scalp_scales'] > 18:
+    if red_patches > 15 and scalp_scales > 18:
         severity = "轻度"
-        if features['red_patches'] > 25:
+        if red_patches > 25:
             severity = "中度"
-        if features['scalp_scales'] > 30:
+        if scalp_scales > 30:
             severity = "重度"
 
         conditions.append({
@@ -581,11 +682,11 @@ def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
 
     # 6. 头癣 (Tinea Capitis) - 真菌感染
     # 更严格：需要多个症状组合
-    if features['scalp_scales'] > 20 and features['dandruff_level'] > 15 and features['hair_density'] < 20 and features['bald_spots_count'] > 0:
+    if scalp_scales > 20 and dandruff_level > 15 and hair_density < 20 and bald_spots_count > 0:
         severity = "轻度"
-        if features['bald_spots_count'] > 2:
+        if bald_spots_count > 2:
             severity = "中度"
-        if features['inflammation_level'] > 20:
+        if inflammation_level > 20:
             severity = "重度"
 
         conditions.append({
@@ -600,10 +701,8 @@ def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
 
     # 7. 接触性皮炎 (Contact Dermatitis)
     # 更严格：需要明显的炎症和颜色不均
-    if features['redness_level'] > 18 and features['inflammation_level'] > 18 and features['color_uniformity'] < 40:
-        severity = "轻度"
-        if features['inflammation_level'] > 22:
-            severity = "中度"
+    if redness_level > 18 and inflammation_level > 18 and color_uniformity < 40:
+        severity = SEVERITY_LEVELS[bisect_left(CONTACT_DERMATITIS_THRESHOLDS, inflammation_level)]
 
         conditions.append({
             'name_cn': '接触性皮炎',
@@ -617,7 +716,7 @@ def diagnose_medical_conditions(features, img_rgb, img_hsv, img_gray):
 
     # 8. 休止期脱发 (Telogen Effluvium)
     # 更严格：需要非常低的密度和质量
-    if features['hair_density'] < 18 and features['texture_quality'] < 25 and features['bald_spots_count'] == 0:
+    if hair_density < 18 and texture_quality < 25 and bald_spots_count == 0:
         conditions.append({
             'name_cn': '休止期脱发',
             'name_en': 'Telogen Effluvium',
@@ -677,14 +776,14 @@ def generate_medical_advice(diagnosed_conditions, features):
 
 def determine_scalp_type(features):
     """基于多维度特征判断头皮类型"""
-    oiliness = features['oiliness']
-    brightness = features['brightness']
+    oiliness = features.oiliness
+    brightness = features.brightness
 
     if oiliness > 65 and brightness > 150:
         return "油性头皮 (Oily Scalp)", 85
     elif oiliness < 40 and brightness < 120:
         return "干性头皮 (Dry Scalp)", 80
-    elif features['redness_level'] > 12:
+    elif features.redness_level > 12:
         return "敏感头皮 (Sensitive Scalp)", 75
     else:
         return "正常头皮 (Normal Scalp)", 90
@@ -693,40 +792,40 @@ def detect_scalp_concerns(features, img_rgb, img_hsv, img_gray):
     """检测头皮问题"""
     concerns = []
 
-    if features['oiliness'] > 70:
+    if features.oiliness > 70:
         concerns.append("⚠️ 油脂分泌过旺，容易堵塞毛孔")
-    elif features['oiliness'] > 60:
+    elif features.oiliness > 60:
         concerns.append("⚡ 轻度油脂分泌过多")
 
-    if features['brightness'] < 100:
+    if features.brightness < 100:
         concerns.append("⚠️ 头皮严重干燥，需要深层补水")
-    elif features['brightness'] < 120:
+    elif features.brightness < 120:
         concerns.append("⚡ 头皮偏干，建议使用保湿产品")
 
-    if features['dandruff_level'] > 8:
+    if features.dandruff_level > 8:
         concerns.append("⚠️ 检测到明显头屑，建议使用去屑洗发水")
-    elif features['dandruff_level'] > 4:
+    elif features.dandruff_level > 4:
         concerns.append("⚡ 轻度头屑迹象")
 
-    if features['redness_level'] > 15:
+    if features.redness_level > 15:
         concerns.append("⚠️ 检测到炎症或红肿，建议就医检查")
-    elif features['redness_level'] > 8:
+    elif features.redness_level > 8:
         concerns.append("⚡ 头皮略微发红，可能有轻度敏感")
 
-    if features['hair_density'] < 15:
+    if features.hair_density < 15:
         concerns.append("⚠️ 头发稀疏，有脱发迹象")
-    elif features['hair_density'] < 25:
+    elif features.hair_density < 25:
         concerns.append("⚡ 头发密度偏低，建议加强养护")
 
-    if features['texture_quality'] < 20:
+    if features.texture_quality < 20:
         concerns.append("⚠️ 头发品质较差，纹理不清晰")
-    elif features['texture_quality'] < 35:
+    elif features.texture_quality < 35:
         concerns.append("⚡ 头发品质一般，需要改善")
 
-    if features['sharpness'] < 50:
+    if features.sharpness < 50:
         concerns.append("📷 图像清晰度偏低，可能影响分析准确度")
 
-    if features['color_uniformity'] < 50:
+    if features.color_uniformity < 50:
         concerns.append("⚡ 头皮颜色不均匀，可能有局部问题")
 
     if len(concerns) == 0:
@@ -735,50 +834,48 @@ def detect_scalp_concerns(features, img_rgb, img_hsv, img_gray):
 
     return concerns
 
+# 健康评分扣分表：(阈值, 扣分) 从严到宽排列，命中第一条即停止
+SEVERITY_PENALTIES = {'重度': 30, '中度': 20, '轻度': 12, '早期': 12}
+OILINESS_PENALTIES = ((70, 15), (60, 8))
+DRYNESS_PENALTIES = ((35, 12),)
+DANDRUFF_PENALTIES = ((8, 15), (4, 8))
+INFLAMMATION_PENALTIES = ((20, 25), (10, 12))
+HAIR_DENSITY_PENALTIES = ((15, 20), (25, 10))
+TEXTURE_PENALTIES = ((20, 15), (35, 8))
+
+def penalty_above(value, table):
+    """数值超过阈值时的扣分（按表顺序取第一条命中）"""
+    for threshold, penalty in table:
+        if value > threshold:
+            return penalty
+    return 0
+
+def penalty_below(value, table):
+    """数值低于阈值时的扣分（按表顺序取第一条命中）"""
+    for threshold, penalty in table:
+        if value < threshold:
+            return penalty
+    return 0
+
 def calculate_health_score(features, concerns, diagnosed_conditions):
     """计算综合健康评分（0-100）"""
     base_score = 100
 
     # 根据诊断疾病扣分
     for condition in diagnosed_conditions:
-        if condition['severity'] == '重度':
-            base_score -= 30
-        elif condition['severity'] == '中度':
-            base_score -= 20
-        elif condition['severity'] == '轻度' or condition['severity'] == '早期':
-            base_score -= 12
-
-    # 油脂扣分
-    if features['oiliness'] > 70:
-        base_score -= 15
-    elif features['oiliness'] > 60:
-        base_score -= 8
-    elif features['oiliness'] < 35:
-        base_score -= 12
-
-    # 头屑扣分
-    if features['dandruff_level'] > 8:
-        base_score -= 15
-    elif features['dandruff_level'] > 4:
-        base_score -= 8
-
-    # 炎症扣分
-    if features['inflammation_level'] > 20:
-        base_score -= 25
-    elif features['inflammation_level'] > 10:
-        base_score -= 12
-
-    # 头发密度扣分
-    if features['hair_density'] < 15:
-        base_score -= 20
-    elif features['hair_density'] < 25:
-        base_score -= 10
-
-    # 头发品质扣分
-    if features['texture_quality'] < 20:
-        base_score -= 15
-    elif features['texture_quality'] < 35:
-        base_score -= 8
+        base_score -= SEVERITY_PENALTIES.get(condition['severity'], 0)
+
+    # 油脂扣分（过油或过干）
+    oiliness = features.oiliness
+    base_score -= penalty_above(oiliness, OILINESS_PENALTIES) or penalty_below(oiliness, DRYNESS_PENALTIES)
+
+    # 头屑、炎症扣分
+    base_score -= penalty_above(features.dandruff_level, DANDRUFF_PENALTIES)
+    base_score -= penalty_above(features.inflammation_level, INFLAMMATION_PENALTIES)
+
+    # 头发密度、头发品质扣分
+    base_score -= penalty_below(features.hair_density, HAIR_DENSITY_PENALTIES)
+    base_score -= penalty_below(features.texture_quality, TEXTURE_PENALTIES)
 
     # 确保分数在0-100范围内
     final_score = max(0, min(100, base_score))
@@ -789,19 +886,19 @@ def calculate_confidence(features):
     """计算置信度（基于图像质量）"""
     confidence = 70
 
-    if features['sharpness'] > 100:
+    if features.sharpness > 100:
         confidence += 15
-    elif features['sharpness'] > 50:
+    elif features.sharpness > 50:
         confidence += 10
     else:
         confidence -= 10
 
-    if features['contrast'] > 40:
+    if features.contrast > 40:
         confidence += 10
-    elif features['contrast'] < 20:
+    elif features.contrast < 20:
         confidence -= 10
 
-    if features['texture_quality'] > 40:
+    if features.texture_quality > 40:
         confidence += 5
 
     confidence = max(60, min(95, confidence))
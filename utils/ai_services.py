@@ -7,20 +7,74 @@ for enhanced scalp analysis
 
 import os
 import base64
+import copy
+import functools
 import json
-import requests
+import re
 import hashlib
+import importlib.util
+import threading
+from collections import OrderedDict
 from typing import Dict, Optional, Tuple, Any
 from PIL import Image
 import io
 import streamlit as st
 
-# Import OpenAI library
-try:
+# OpenAI library: only check it is installed here; the package (~0.4s to import) is
+# loaded on first client creation, so local-only analysis never pays for it
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
+
+# AI分析结果缓存（LRU）：{缓存键: 分析结果}
+# 放在模块级，所有服务实例共享——app每次点击分析都会新建服务实例，实例级缓存永远不会命中
+AI_RESULT_CACHE_SIZE = 32
+_ai_result_cache = OrderedDict()
+_ai_result_cache_lock = threading.Lock()
+
+def get_cached_result(cache_key: str) -> Optional[Dict]:
+    """读取缓存的分析结果（返回深拷贝，调用方会修改其中的列表），未命中返回None"""
+    with _ai_result_cache_lock:
+        cached = _ai_result_cache.get(cache_key)
+        if cached is None:
+            return None
+        _ai_result_cache.move_to_end(cache_key)
+        return copy.deepcopy(cached)
+
+def store_cached_result(cache_key: str, result: Dict):
+    """保存分析结果，超出容量时淘汰最久未使用的条目"""
+    with _ai_result_cache_lock:
+        _ai_result_cache[cache_key] = copy.deepcopy(result)
+        _ai_result_cache.move_to_end(cache_key)
+        if len(_ai_result_cache) > AI_RESULT_CACHE_SIZE:
+            _ai_result_cache.popitem(last=False)
+
+# OpenAI视觉模型处理图片的最长边（high detail模式下更大的图片会被服务端缩小）
+OPENAI_MAX_IMAGE_SIDE = 2048
+
+# ChatGPT模式Markdown回复中的健康评分、头皮类型
+HEALTH_SCORE_RE = re.compile(r'头皮健康得分：(\d+)/100')
+SCALP_TYPE_RE = re.compile(r'您的头皮整体状态属于([^。\n]+)')
+
+_json_decoder = json.JSONDecoder()
+
+def extract_json_object(text: str) -> Optional[Dict]:
+    """
+    从模型回复中取出JSON对象（容忍前后的说明文字和```代码块标记）
+
+    只从第一个 '{' 开始用 raw_decode 单次正向解析，不再用贪婪正则截取到最后一个 '}'。
+    没有 '{' 时返回None；解析失败（如回复被max_tokens截断）时抛出JSONDecodeError，
+    不会退而返回其中某个嵌套的子对象。
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    obj, _ = _json_decoder.raw_decode(text, start)
+    return obj
+
+@functools.lru_cache(maxsize=4)
+def get_openai_client(api_key: str):
+    """按API密钥复用OpenAI客户端：连接池中的HTTPS长连接跨请求复用，省去每次分析的TCP/TLS握手"""
     from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+    return OpenAI(api_key=api_key)
 
 class AIServiceBase:
     """Base class for AI services"""
@@ -32,114 +86,8 @@ class AIServiceBase:
         """Analyze scalp image using AI service"""
         raise NotImplementedError
 
-class OpenAIService(AIServiceBase):
-    """OpenAI GPT-4 Vision service for scalp analysis"""
-
-    def __init__(self, api_key: str):
-        super().__init__(api_key)
-        if not OPENAI_AVAILABLE:
-            raise ImportError("Please install openai: pip install openai")
-        self.client = OpenAI(api_key=api_key)
-        # 结果缓存字典: {image_hash: analysis_result}
-        self._result_cache = {}
-
-    def _calculate_image_hash(self, image: Image.Image) -> str:
-        """计算图像的哈希值用于缓存"""
-        # 将图像转换为字节流
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_bytes = buffered.getvalue()
-        # 计算SHA256哈希
-        return hashlib.sha256(img_bytes).hexdigest()
-
-    def _enhance_image_quality(self, image: Image.Image) -> Image.Image:
-        """Enhance image quality for better AI analysis
-        注意：减弱了增强强度，避免改变颜色特征影响诊断
-        """
-        from PIL import ImageEnhance
-
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-
-        # Resize if too large (max 1920px on longest side for quality/cost balance)
-        max_size = 1920
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-
-        # 减弱增强强度，保持更接近原图
-        # Enhance sharpness (更轻微，从1.2降到1.05)
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.05)
-
-        # Enhance contrast (更轻微，从1.1降到1.02)
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.02)
-
-        # Enhance color saturation (极轻微，从1.05降到1.01)
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(1.01)
-
-        return image
-
-    def analyze_scalp_image(self, image: Image.Image, language='zh') -> Dict:
-        """Use GPT-4 Vision to analyze scalp image
-
-        Args:
-            image: PIL Image对象
-            language: 语言设置，可以是字符串或包含参数的字典
-                     如: {'lang': 'zh', 'use_cache': False, 'analysis_mode': 'chatgpt'}
-        """
-        # 解析参数
-        if isinstance(language, dict):
-            language_params = language
-            lang = language_params.get('lang', 'zh')
-            use_cache = language_params.get('use_cache', True)
-        else:
-            language_params = {}
-            lang = language
-            use_cache = True
-
-        # 计算图像哈希值
-        image_hash = self._calculate_image_hash(image)
-
-        # 检查缓存（可通过参数禁用）
-        if use_cache and image_hash in self._result_cache:
-            try:
-                print(f"[CACHE HIT] Using cached result (hash: {image_hash[:16]}...)")
-            except:
-                pass  # 忽略打印错误
-            cached_result = self._result_cache[image_hash].copy()
-            cached_result['_from_cache'] = True  # 标记为缓存结果
-            return cached_result
-
-        try:
-            print(f"[CACHE MISS] Calling AI analysis (hash: {image_hash[:16]}...)")
-        except:
-            pass  # 忽略打印错误
-
-        # 图像预处理选项（可通过参数控制）
-        # 注意：预处理可能改变颜色特征，影响诊断准确性
-        # ChatGPT不使用预处理，直接分析原图
-        enable_preprocessing = language_params.get('enable_preprocessing', False) if isinstance(language, dict) else False
-        if enable_preprocessing:
-            image = self._enhance_image_quality(image)
-        # else: 使用原图，与ChatGPT保持一致
-
-        # Convert image to base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG", quality=95)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-
-        # Create prompt based on language and mode
-        analysis_mode = language_params.get('analysis_mode', 'balanced')
-
-        if analysis_mode == 'chatgpt':
-            # ChatGPT对齐模式 - 详细且有文采的分析
-            if lang == 'zh':
-                prompt = """
+# 分析提示词（模块常量：ChatGPT对齐模式 / 医学诊断模式，中英文各一份）
+CHATGPT_PROMPT_ZH = """
                 请分析这张头皮图像并提供观察报告。
 
                 分析这张图像中可见的特征，包括：
@@ -185,8 +133,8 @@ class OpenAIService(AIServiceBase):
 
                 请注意：这只是基于图像的观察分析，不构成专业建议。
                 """
-            else:
-                prompt = """
+
+CHATGPT_PROMPT_EN = """
                 As a professional scalp health analysis system, I will provide you with a detailed scalp condition assessment.
 
                 Please carefully analyze this scalp image, observing from the following dimensions:
@@ -238,10 +186,8 @@ class OpenAIService(AIServiceBase):
                     "analysis_summary": "Comprehensive analysis (400-600 words):\n\nOpening: Kindly inform the user of the overall condition.\n\nDetailed analysis: Explain each observed feature one by one and its significance.\n\nCause exploration: Analyze factors that may lead to the current condition.\n\nImprovement plan: Provide systematic improvement suggestions and care plans.\n\nPositive outlook: Give encouragement and confidence, emphasizing improvement through proper care.\n\nClosing: Warm summary and wishes."
                 }
                 """
-        else:
-            # 原有的详细医学prompt（严格模式或平衡模式）
-            if lang == 'zh':
-                prompt = """
+
+MEDICAL_PROMPT_ZH = """
             你是一位具有20年临床经验的皮肤科主任医师和毛发病理学专家，专攻头皮疾病诊断、毛囊显微分析和毛发医学。请以最高医学标准对这张头皮图像进行深度分析。
 
             **🔬 图像类型识别**（重要！）：
@@ -372,8 +318,8 @@ class OpenAIService(AIServiceBase):
             }
             - 只返回 JSON，不要添加任何其他文字说明
             """
-            else:
-                prompt = """
+
+MEDICAL_PROMPT_EN = """
             You are a senior dermatologist with 20 years of experience specializing in scalp pathology and trichology. Please analyze this scalp image with the highest medical standards.
 
             **🔬 Image Type Recognition** (IMPORTANT!):
@@ -494,6 +440,135 @@ class OpenAIService(AIServiceBase):
             - For microscopic images, describe what you see at micro-level
             """
 
+class OpenAIService(AIServiceBase):
+    """OpenAI GPT-4 Vision service for scalp analysis"""
+
+    def __init__(self, api_key: str):
+        super().__init__(api_key)
+        if not OPENAI_AVAILABLE:
+            raise ImportError("Please install openai: pip install openai")
+        self.client = get_openai_client(api_key)
+
+    def _calculate_image_hash(self, image: Image.Image) -> str:
+        """计算图像的哈希值用于缓存"""
+        # 直接对像素字节（连同模式和尺寸）做SHA256，不必为了算哈希先编码一次PNG
+        digest = hashlib.sha256(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def _enhance_image_quality(self, image: Image.Image) -> Image.Image:
+        """Enhance image quality for better AI analysis
+        注意：减弱了增强强度，避免改变颜色特征影响诊断
+        """
+        import cv2
+        import numpy as np
+
+        # Convert to RGB if needed
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        # Resize if too large (max 1920px on longest side for quality/cost balance)
+        max_size = 1920
+        if max(image.size) > max_size:
+            ratio = max_size / max(image.size)
+            new_size = tuple(int(dim * ratio) for dim in image.size)
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+        # 减弱增强强度，保持更接近原图
+        sharpness = 1.05  # 锐度（更轻微，从1.2降到1.05）
+        contrast = 1.02   # 对比度（更轻微，从1.1降到1.02）
+        color = 1.01      # 饱和度（极轻微，从1.05降到1.01）
+
+        # 与PIL ImageEnhance的Sharpness→Contrast→Color公式相同，但只做两次遍历：
+        # 锐化 = SMOOTH平滑图与原图的线性混合，合成一个3x3卷积核
+        arr = np.asarray(image)
+        smooth = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], np.float32) / 13
+        identity = np.zeros((3, 3), np.float32)
+        identity[1, 1] = 1
+        sharpened = cv2.filter2D(arr, -1, smooth + sharpness * (identity - smooth),
+                                 borderType=cv2.BORDER_REPLICATE)
+
+        # 对比度（向平均亮度混合）和饱和度（向逐像素亮度混合）都是线性变换，合成一个3x4颜色矩阵
+        luma = np.array([0.299, 0.587, 0.114], np.float32)
+        mean_luma = int(float(np.dot(luma, cv2.mean(sharpened)[:3])) + 0.5)
+        matrix = contrast * (color * np.eye(3, dtype=np.float32) + (1 - color) * np.outer(np.ones(3, np.float32), luma))
+        offset = np.full((3, 1), (1 - contrast) * mean_luma, np.float32)
+        enhanced = cv2.transform(sharpened, np.hstack([matrix, offset]))
+
+        return Image.fromarray(enhanced)
+
+    def analyze_scalp_image(self, image: Image.Image, language='zh') -> Dict:
+        """Use GPT-4 Vision to analyze scalp image
+
+        Args:
+            image: PIL Image对象
+            language: 语言设置，可以是字符串或包含参数的字典
+                     如: {'lang': 'zh', 'use_cache': False, 'analysis_mode': 'chatgpt'}
+        """
+        # 解析参数
+        if isinstance(language, dict):
+            language_params = language
+            lang = language_params.get('lang', 'zh')
+            use_cache = language_params.get('use_cache', True)
+        else:
+            language_params = {}
+            lang = language
+            use_cache = True
+
+        analysis_mode = language_params.get('analysis_mode', 'balanced')
+        enable_preprocessing = language_params.get('enable_preprocessing', False)
+
+        # 计算图像哈希值；缓存键还包含语言/模式/模型/预处理，切换设置后不会拿到旧结果
+        image_hash = self._calculate_image_hash(image)
+        cache_key = "|".join([image_hash, lang, analysis_mode,
+                              str(language_params.get('preferred_model')), str(enable_preprocessing)])
+
+        # 检查缓存（可通过参数禁用）
+        cached_result = get_cached_result(cache_key) if use_cache else None
+        if cached_result is not None:
+            try:
+                print(f"[CACHE HIT] Using cached result (hash: {image_hash[:16]}...)")
+            except:
+                pass  # 忽略打印错误
+            cached_result['_from_cache'] = True  # 标记为缓存结果
+            return cached_result
+
+        try:
+            print(f"[CACHE MISS] Calling AI analysis (hash: {image_hash[:16]}...)")
+        except:
+            pass  # 忽略打印错误
+
+        # 图像预处理选项（可通过参数控制）
+        # 注意：预处理可能改变颜色特征，影响诊断准确性
+        # ChatGPT不使用预处理，直接分析原图
+        if enable_preprocessing:
+            image = self._enhance_image_quality(image)
+        # else: 使用原图，与ChatGPT保持一致
+
+        # OpenAI在high detail下会先把图片缩到2048x2048以内，更大的原图上传了也用不上，
+        # 先在本地等比缩小，请求体和编码耗时随像素数下降（resize返回新图，不改动调用方的图片）
+        if max(image.size) > OPENAI_MAX_IMAGE_SIDE:
+            ratio = OPENAI_MAX_IMAGE_SIDE / max(image.size)
+            new_size = tuple(max(1, int(dim * ratio)) for dim in image.size)
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+        # Convert image to base64
+        # 高质量JPEG（quality=95、4:4:4不做色度抽样，颜色与原图几乎无差别），照片体积只有PNG的几分之一；
+        # getbuffer()直接把缓冲区交给b64encode，省去一次字节拷贝
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=95, subsampling=0)
+        img_base64 = base64.b64encode(buffered.getbuffer()).decode('ascii')
+
+        # Create prompt based on language and mode
+        if analysis_mode == 'chatgpt':
+            # ChatGPT对齐模式 - 详细且有文采的分析
+            prompt = CHATGPT_PROMPT_ZH if lang == 'zh' else CHATGPT_PROMPT_EN
+        else:
+            # 原有的详细医学prompt（严格模式或平衡模式）
+            prompt = MEDICAL_PROMPT_ZH if lang == 'zh' else MEDICAL_PROMPT_EN
+
         try:
             # 根据分析模式选择模型
             preferred_model = language_params.get('preferred_model', None)
@@ -545,17 +620,19 @@ class OpenAIService(AIServiceBase):
                             },
                             {
                                 "role": "user",
+                                # 固定的提示词放在图片之前：system+提示词构成每次请求相同的前缀，
+                                # 可命中OpenAI的自动提示词缓存（≥1024 tokens的相同前缀按缓存价计费、首字更快）
                                 "content": [
+                                    {
+                                        "type": "text",
+                                        "text": prompt_text
+                                    },
                                     {
                                         "type": "image_url",
                                         "image_url": {
-                                            "url": f"data:image/png;base64,{img_base64}",
+                                            "url": f"data:image/jpeg;base64,{img_base64}",
                                             "detail": "high"
                                         }
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": prompt_text
                                     }
                                 ]
                             }
@@ -642,17 +719,15 @@ class OpenAIService(AIServiceBase):
                 # 检查是否是ChatGPT模式的Markdown输出
                 if analysis_mode == 'chatgpt' and '## 🧠' in response_text:
                     # ChatGPT模式 - 直接使用Markdown格式
-                    import re
-
                     # 提取健康评分
-                    score_match = re.search(r'头皮健康得分：(\d+)/100', response_text)
+                    score_match = HEALTH_SCORE_RE.search(response_text)
                     health_score = int(score_match.group(1)) if score_match else 75
 
                     # 提取是否需要就医
                     need_doctor = '是否需要就医：是' in response_text or 'need medical attention: yes' in response_text.lower()
 
                     # 提取头皮类型（从初步观察结果中）
-                    type_match = re.search(r'您的头皮整体状态属于([^。\n]+)', response_text)
+                    type_match = SCALP_TYPE_RE.search(response_text)
                     scalp_type = type_match.group(1) if type_match else "偏油性头皮"
 
                     result = {
@@ -670,12 +745,9 @@ class OpenAIService(AIServiceBase):
                 else:
                     # 原有的JSON解析逻辑
                     try:
-                        import re
                         # Try to extract JSON
-                        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                        if json_match:
-                            json_str = json_match.group()
-                            result = json.loads(json_str)
+                        result = extract_json_object(response_text)
+                        if result is not None:
 
                             # Save raw response for debugging
                             result['ai_raw_response'] = response_text
@@ -714,12 +786,13 @@ class OpenAIService(AIServiceBase):
             }
             result['model_display_name'] = model_display_names.get(used_model, used_model)
 
-            # 保存到缓存
-            self._result_cache[image_hash] = result.copy()
-            try:
-                print(f"[CACHE SAVED] Result cached (hash: {image_hash[:16]}...)")
-            except:
-                pass  # 忽略打印错误
+            # 保存到缓存（AI拒绝分析、JSON解析失败的结果不缓存，下次重新请求）
+            if not result.get('_was_refused') and 'parse_error' not in result:
+                store_cached_result(cache_key, result)
+                try:
+                    print(f"[CACHE SAVED] Result cached (hash: {image_hash[:16]}...)")
+                except:
+                    pass  # 忽略打印错误
 
             return result
 
@@ -734,6 +807,26 @@ class OpenAIService(AIServiceBase):
                 "analysis_summary": f"Error: {str(e)}"
             }
 
+# 疾病图标映射（关键词均为小写，按顺序匹配第一个出现在中/英文名称中的关键词）
+CONDITION_ICONS = (
+    ('脂溢性皮炎', '🔴'),
+    ('seborrheic dermatitis', '🔴'),
+    ('银屑病', '🔵'),
+    ('psoriasis', '🔵'),
+    ('毛囊炎', '🟡'),
+    ('folliculitis', '🟡'),
+    ('斑秃', '⚪'),
+    ('alopecia areata', '⚪'),
+    ('脂溢性脱发', '🟠'),
+    ('androgenetic alopecia', '🟠'),
+    ('头癣', '🟢'),
+    ('tinea capitis', '🟢'),
+    ('接触性皮炎', '🟣'),
+    ('contact dermatitis', '🟣'),
+    ('休止期脱发', '⚫'),
+    ('telogen effluvium', '⚫'),
+)
+
 class AIServiceManager:
     """Manager for AI services"""
 
@@ -759,26 +852,6 @@ class AIServiceManager:
     @staticmethod
     def _normalize_condition(cond: Dict) -> Dict:
         """Normalize a condition dict to include all required fields for UI display"""
-        # Disease icon mapping
-        icon_map = {
-            '脂溢性皮炎': '🔴',
-            'seborrheic dermatitis': '🔴',
-            '银屑病': '🔵',
-            'psoriasis': '🔵',
-            '毛囊炎': '🟡',
-            'folliculitis': '🟡',
-            '斑秃': '⚪',
-            'alopecia areata': '⚪',
-            '脂溢性脱发': '🟠',
-            'androgenetic alopecia': '🟠',
-            '头癣': '🟢',
-            'tinea capitis': '🟢',
-            '接触性皮炎': '🟣',
-            'contact dermatitis': '🟣',
-            '休止期脱发': '⚫',
-            'telogen effluvium': '⚫',
-        }
-
         normalized = cond.copy()
 
         # Add icon if missing
@@ -786,8 +859,8 @@ class AIServiceManager:
             name_cn = normalized.get('name_cn', '').lower()
             name_en = normalized.get('name_en', '').lower()
             normalized['icon'] = '🔴'  # default
-            for key, icon in icon_map.items():
-                if key.lower() in name_cn or key.lower() in name_en:
+            for key, icon in CONDITION_ICONS:
+                if key in name_cn or key in name_en:
                     normalized['icon'] = icon
                     break
 
@@ -836,7 +909,7 @@ class AIServiceManager:
         if ai_result and 'error' not in ai_result:
             # Map AI conditions to the expected format and normalize them
             ai_conditions = ai_result.get('conditions', [])
-            normalized_conditions = [AIServiceManager._normalize_condition(cond) for cond in ai_conditions]
+            normalized_conditions = list(map(AIServiceManager._normalize_condition, ai_conditions))
             combined['diagnosed_conditions'] = normalized_conditions
 
             # Optionally add unique local conditions as supplementary
@@ -852,8 +925,8 @@ class AIServiceManager:
                         cond_copy['source'] = 'local_analysis'
                         combined['diagnosed_conditions'].append(cond_copy)
 
-            # Use AI recommendations as primary
-            combined['concerns'] = ai_result.get('recommendations', [])
+            # Use AI recommendations as primary（新建列表，下面追加本地问题时不会改动ai_result里的原列表）
+            combined['concerns'] = list(ai_result.get('recommendations', []))
 
             # Add local concerns as supplementary if not already covered
             if local_result.get('concerns'):
@@ -904,15 +977,6 @@ def test_ai_service():
     # Test with a dummy image
     test_image = Image.new('RGB', (300, 300), color=(200, 180, 160))
 
-    # Test Claude if available
-    if CLAUDE_AVAILABLE:
-        claude_key = os.getenv("ANTHROPIC_API_KEY", "")
-        if claude_key:
-            print("\nTesting Claude Service...")
-            claude_service = ClaudeService(claude_key)
-            result = claude_service.analyze_scalp_image(test_image)
-            print(f"Result: {json.dumps(result, indent=2, ensure_ascii=False)}")
-
     # Test OpenAI if available
     if OPENAI_AVAILABLE:
         openai_key = os.getenv("OPENAI_API_KEY", "")
@@ -3,12 +3,23 @@ SQLite数据库模型和管理
 Database models and management
 """
 import os
+import re
+import json
+import base64
 import sqlite3
+import threading
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 import pandas as pd
 from contextlib import contextmanager
 
+# orjson（C实现）用于分析记录中JSON字段的编解码，不可用时回退到标准库json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # 数据库文件路径
 DB_PATH = "data/scalp_analyzer.db"
 
@@ -17,11 +28,62 @@ def get_db_connection():
     """获取数据库连接的上下文管理器"""
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row  # 返回字典式的行
+    conn.execute("PRAGMA synchronous=NORMAL")  # WAL模式下提交时无需每次fsync
     try:
         yield conn
     finally:
         conn.close()
 
+def _dumps_json(value) -> str:
+    """将列表/字典编码为JSON字符串（保留中文）"""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+        except orjson.JSONEncodeError:
+            pass  # 例如numpy标量等orjson不支持的类型
+    return json.dumps(value, ensure_ascii=False)
+
+def _loads_json(text):
+    """解析JSON字符串"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(text)
+    return json.loads(text)
+
+# 进程内共享的持久连接（产品目录和分析历史的高频读写使用）
+_shared_conn = None
+_shared_conn_lock = threading.RLock()
+
+@contextmanager
+def get_shared_connection():
+    """
+    获取进程内共享的持久连接的上下文管理器
+    使用WAL + synchronous=NORMAL，避免每次调用都打开连接并fsync；
+    自动提交模式，使用期间持有锁以保证多线程安全
+    """
+    global _shared_conn
+    with _shared_conn_lock:
+        if _shared_conn is None:
+            conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                                   cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-20000")  # 约20MB页缓存
+            _shared_conn = conn
+        yield _shared_conn
+
+@contextmanager
+def _transaction(conn):
+    """在自动提交模式的共享连接上执行显式事务（成功时提交，异常时回滚）"""
+    conn.execute("BEGIN")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
 def init_database():
     """初始化数据库表结构"""
     os.makedirs("data", exist_ok=True)
@@ -29,6 +91,9 @@ def init_database():
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
+        # WAL日志模式（持久化在数据库文件中，读写互不阻塞）
+        cursor.execute("PRAGMA journal_mode=WAL")
+
         # 产品表
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS products (
@@ -102,6 +167,63 @@ def init_database():
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_session ON analysis_history(session_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_created ON analysis_history(created_at)")
 
+        # 元数据表：产品目录版本号，由触发器在增删改时递增（用于缓存失效）
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('products_version', 0)")
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_products_version_{event.lower()}
+            AFTER {event} ON products
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'products_version';
+            END
+            """)
+
+        # 产品全文索引（trigram分词支持中文子串匹配），由触发器与products表保持同步
+        try:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+            fts_exists = cursor.fetchone() is not None
+            cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, brand, type, description, concern,
+                content='products', content_rowid='id', tokenize='trigram'
+            )
+            """)
+            cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products
+            BEGIN
+                INSERT INTO products_fts(rowid, name, brand, type, description, concern)
+                VALUES (new.id, new.name, new.brand, new.type, new.description, new.concern);
+            END
+            """)
+            cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products
+            BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name, brand, type, description, concern)
+                VALUES ('delete', old.id, old.name, old.brand, old.type, old.description, old.concern);
+            END
+            """)
+            cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_products_fts_update
+            AFTER UPDATE OF name, brand, type, description, concern ON products
+            BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name, brand, type, description, concern)
+                VALUES ('delete', old.id, old.name, old.brand, old.type, old.description, old.concern);
+                INSERT INTO products_fts(rowid, name, brand, type, description, concern)
+                VALUES (new.id, new.name, new.brand, new.type, new.description, new.concern);
+            END
+            """)
+            # 首次创建时为已有产品建立索引
+            if not fts_exists:
+                cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            pass  # SQLite未编译FTS5/trigram时退回LIKE搜索
+
         conn.commit()
         try:
             print("Database tables initialized successfully")
@@ -113,17 +235,47 @@ class ProductDB:
     @staticmethod
     def get_all_products(active_only=True) -> pd.DataFrame:
         """获取所有产品"""
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             query = "SELECT * FROM products"
             if active_only:
                 query += " WHERE is_active = 1"
             query += " ORDER BY id"
             return pd.read_sql_query(query, conn)
 
+    @staticmethod
+    def get_catalog_version() -> int:
+        """获取产品目录版本号（增删改时由触发器递增，用于缓存失效）"""
+        with get_shared_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM meta WHERE key = 'products_version'")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+
+    @staticmethod
+    def get_stats() -> Dict:
+        """获取产品统计（单条SQL聚合：总数、活跃数、活跃产品均价、有图片的活跃产品数）"""
+        with get_shared_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT COUNT(*) as total,
+                   COALESCE(SUM(is_active = 1), 0) as active,
+                   AVG(CASE WHEN is_active = 1 THEN price_myr END) as avg_price,
+                   COALESCE(SUM(is_active = 1 AND image IS NOT NULL AND image <> ''), 0) as with_images
+            FROM products
+            """)
+            row = cursor.fetchone()
+
+            return {
+                'total_products': row['total'],
+                'active_products': row['active'],
+                'avg_price': row['avg_price'] or 0,
+                'with_images': row['with_images']
+            }
+
     @staticmethod
     def get_product_by_id(product_id: int) -> Optional[Dict]:
         """根据ID获取产品"""
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
             row = cursor.fetchone()
@@ -132,29 +284,43 @@ class ProductDB:
             return None
 
     @staticmethod
-    def add_product(product_data: Dict) -> int:
-        """添加新产品"""
-        with get_db_connection() as conn:
+    def add_product(product_data: Dict, image_saver=None) -> int:
+        """添加新产品
+
+        image_saver: 可选回调，参数为新产品ID，返回保存的图片文件名；
+        图片字段在同一事务内写入，只提交一次
+        """
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
 
             columns = ['name', 'brand', 'type', 'suitable_for', 'concern',
                       'price_myr', 'link', 'description', 'image']
+            # 可选列（库存、状态）只在提供时写入，否则使用表默认值
+            columns += [col for col in ('stock_quantity', 'is_active') if col in product_data]
             values = [product_data.get(col, '') for col in columns]
 
             placeholders = ','.join(['?' for _ in columns])
             columns_str = ','.join(columns)
 
-            cursor.execute(
-                f"INSERT INTO products ({columns_str}) VALUES ({placeholders})",
-                values
-            )
-            conn.commit()
-            return cursor.lastrowid
+            with _transaction(conn):  # 事务：成功时提交，异常时回滚
+                cursor.execute(
+                    f"INSERT INTO products ({columns_str}) VALUES ({placeholders})",
+                    values
+                )
+                product_id = cursor.lastrowid
+
+                # 图片文件名依赖新ID，保存后在同一事务内回填
+                if image_saver is not None:
+                    image_filename = image_saver(product_id)
+                    if image_filename:
+                        cursor.execute("UPDATE products SET image = ? WHERE id = ?",
+                                       (image_filename, product_id))
+            return product_id
 
     @staticmethod
     def update_product(product_id: int, product_data: Dict) -> bool:
         """更新产品信息"""
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
 
             # 构建更新语句
@@ -170,31 +336,45 @@ class ProductDB:
             values.append(product_id)
 
             query = f"UPDATE products SET {', '.join(update_fields)} WHERE id = ?"
-            cursor.execute(query, values)
-            conn.commit()
+            with _transaction(conn):
+                cursor.execute(query, values)
             return cursor.rowcount > 0
 
     @staticmethod
     def delete_product(product_id: int, soft_delete=True) -> bool:
         """删除产品（软删除或硬删除）"""
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
 
-            if soft_delete:
-                cursor.execute(
-                    "UPDATE products SET is_active = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                    (product_id,)
-                )
-            else:
-                cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            with _transaction(conn):
+                if soft_delete:
+                    cursor.execute(
+                        "UPDATE products SET is_active = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                        (product_id,)
+                    )
+                else:
+                    cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
 
-            conn.commit()
             return cursor.rowcount > 0
 
     @staticmethod
     def search_products(keyword: str) -> pd.DataFrame:
-        """搜索产品"""
-        with get_db_connection() as conn:
+        """搜索产品（全文索引优先，关键词不足3个字符或无FTS5时使用LIKE）"""
+        with get_shared_connection() as conn:
+            if len(keyword) >= 3:
+                fts_query = """
+                SELECT p.* FROM products_fts f
+                JOIN products p ON p.id = f.rowid
+                WHERE products_fts MATCH ? AND p.is_active = 1
+                ORDER BY p.name
+                """
+                # 整体作为短语匹配（trigram下等价于子串匹配）
+                phrase = '"' + keyword.replace('"', '""') + '"'
+                try:
+                    return pd.read_sql_query(fts_query, conn, params=(phrase,))
+                except (sqlite3.OperationalError, pd.errors.DatabaseError):
+                    pass
+
             query = """
             SELECT * FROM products
             WHERE is_active = 1
@@ -216,15 +396,13 @@ class AnalysisHistoryDB:
     @staticmethod
     def save_analysis(analysis_data: Dict) -> int:
         """保存分析结果"""
-        import json
-
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
 
             # 将列表和字典转换为JSON字符串
-            concerns_json = json.dumps(analysis_data.get('concerns', []), ensure_ascii=False)
-            conditions_json = json.dumps(analysis_data.get('diagnosed_conditions', []), ensure_ascii=False)
-            recommendations_json = json.dumps(analysis_data.get('recommendations', []), ensure_ascii=False)
+            concerns_json = _dumps_json(analysis_data.get('concerns', []))
+            conditions_json = _dumps_json(analysis_data.get('diagnosed_conditions', []))
+            recommendations_json = _dumps_json(analysis_data.get('recommendations', []))
 
             cursor.execute("""
             INSERT INTO analysis_history
@@ -243,15 +421,12 @@ class AnalysisHistoryDB:
                 analysis_data.get('user_id', '')
             ))
 
-            conn.commit()
             return cursor.lastrowid
 
     @staticmethod
     def get_user_history(session_id: str, limit: int = 10) -> List[Dict]:
         """获取用户的分析历史（通过session_id）"""
-        import json
-
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
             SELECT * FROM analysis_history
@@ -264,19 +439,48 @@ class AnalysisHistoryDB:
             for row in cursor.fetchall():
                 record = dict(row)
                 # 解析JSON字符串
-                record['concerns'] = json.loads(record.get('concerns', '[]'))
-                record['diagnosed_conditions'] = json.loads(record.get('diagnosed_conditions', '[]'))
-                record['recommendations'] = json.loads(record.get('recommendations', '[]'))
+                record['concerns'] = _loads_json(record.get('concerns', '[]'))
+                record['diagnosed_conditions'] = _loads_json(record.get('diagnosed_conditions', '[]'))
+                record['recommendations'] = _loads_json(record.get('recommendations', '[]'))
                 history.append(record)
 
             return history
 
+    @staticmethod
+    def get_user_summary(session_id: str) -> Dict:
+        """获取会话的汇总统计（SQL聚合，无需解析JSON字段）"""
+        with get_shared_connection() as conn:
+            cursor = conn.cursor()
+
+            # 分析次数和平均健康评分
+            cursor.execute("""
+            SELECT COUNT(*) as total, AVG(health_score) as avg_score
+            FROM analysis_history WHERE session_id = ?
+            """, (session_id,))
+            row = cursor.fetchone()
+            total_analyses = row['total']
+            avg_health_score = row['avg_score'] or 0
+
+            # 最常见的头皮类型（次数相同时取最近一次）
+            cursor.execute("""
+            SELECT scalp_type FROM analysis_history
+            WHERE session_id = ?
+            GROUP BY scalp_type
+            ORDER BY COUNT(*) DESC, MAX(created_at) DESC
+            LIMIT 1
+            """, (session_id,))
+            most_common = cursor.fetchone()
+
+            return {
+                'total_analyses': total_analyses,
+                'avg_health_score': round(avg_health_score, 1),
+                'most_common_type': most_common['scalp_type'] if most_common else "无"
+            }
+
     @staticmethod
     def get_user_history_by_id(user_id: str, limit: int = 50) -> List[Dict]:
         """获取用户的分析历史（通过user_id）"""
-        import json
-
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
             SELECT * FROM analysis_history
@@ -289,9 +493,9 @@ class AnalysisHistoryDB:
             for row in cursor.fetchall():
                 record = dict(row)
                 # 解析JSON字符串
-                record['concerns'] = json.loads(record.get('concerns', '[]'))
-                record['diagnosed_conditions'] = json.loads(record.get('diagnosed_conditions', '[]'))
-                record['recommendations'] = json.loads(record.get('recommendations', '[]'))
+                record['concerns'] = _loads_json(record.get('concerns', '[]'))
+                record['diagnosed_conditions'] = _loads_json(record.get('diagnosed_conditions', '[]'))
+                record['recommendations'] = _loads_json(record.get('recommendations', '[]'))
                 history.append(record)
 
             return history
@@ -299,7 +503,7 @@ class AnalysisHistoryDB:
     @staticmethod
     def get_user_statistics(user_id: str) -> Dict:
         """获取用户的统计数据"""
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
 
             # 总分析次数
@@ -342,7 +546,7 @@ class AnalysisHistoryDB:
     @staticmethod
     def get_statistics() -> Dict:
         """获取统计数据"""
-        with get_db_connection() as conn:
+        with get_shared_connection() as conn:
             cursor = conn.cursor()
 
             # 总分析次数
@@ -409,6 +613,18 @@ class RecommendationDB:
             return pd.read_sql_query(query, conn, params=(limit,))
 
 # 数据迁移函数
+# CSV迁移时写入的产品列（保留CSV中的ID，图片文件名依赖它）
+PRODUCT_CSV_COLUMNS = ['id', 'name', 'brand', 'type', 'suitable_for', 'concern',
+                       'price_myr', 'link', 'description', 'image']
+# CSV列类型（跳过类型推断；价格保持float64以免写入库时出现精度误差）
+PRODUCT_CSV_DTYPES = {
+    'id': 'int64', 'name': 'string', 'brand': 'string', 'type': 'category',
+    'suitable_for': 'category', 'concern': 'string', 'price_myr': 'float64',
+    'link': 'string', 'description': 'string', 'image': 'string'
+}
+# executemany每批行数（超过约1万行后收益趋于饱和）
+MIGRATION_BATCH_SIZE = 10000
+
 def migrate_from_csv():
     """从CSV文件迁移数据到SQLite"""
     import os
@@ -424,7 +640,8 @@ def migrate_from_csv():
 
     try:
         # 读取CSV数据
-        df = pd.read_csv(csv_path)
+        df = pd.read_csv(csv_path, dtype=PRODUCT_CSV_DTYPES, engine='c',
+                         usecols=lambda col: col in PRODUCT_CSV_DTYPES)
 
         with get_db_connection() as conn:
             # 先清空产品表（如果需要）
@@ -437,20 +654,16 @@ def migrate_from_csv():
                     pass
                 return False
 
-            # 迁移数据到SQLite
-            for _, row in df.iterrows():
-                product_data = {
-                    'name': row.get('name', ''),
-                    'brand': row.get('brand', ''),
-                    'type': row.get('type', ''),
-                    'suitable_for': row.get('suitable_for', ''),
-                    'concern': row.get('concern', ''),
-                    'price_myr': float(row.get('price_myr', 0)),
-                    'link': row.get('link', ''),
-                    'description': row.get('description', ''),
-                    'image': row.get('image', '')
-                }
-                ProductDB.add_product(product_data)
+            # 迁移数据到SQLite：单个事务内用executemany分批写入
+            columns = [col for col in PRODUCT_CSV_COLUMNS if col in df.columns]
+            df = df[columns].astype(object).where(df[columns].notna(), None)
+            rows = list(df.itertuples(index=False, name=None))
+            sql = (f"INSERT INTO products ({','.join(columns)}) "
+                   f"VALUES ({','.join('?' for _ in columns)})")
+
+            with conn:
+                for start in range(0, len(rows), MIGRATION_BATCH_SIZE):
+                    conn.executemany(sql, rows[start:start + MIGRATION_BATCH_SIZE])
 
             try:
                 print(f"Successfully migrated {len(df)} products to SQLite database")
@@ -465,6 +678,55 @@ def migrate_from_csv():
             pass
         return False
 
+# 产品图片目录及文件名格式（product_<id>.<ext>，缩略图为 product_<id>.<ext>.thumb.webp）
+PRODUCT_IMAGE_DIR = "assets/products"
+_PRODUCT_IMAGE_RE = re.compile(r"^product_(\d+)\.")
+
+# 无图片时的本地占位图（内联SVG的data URI，st.image和<img src>均可直接使用，无需请求外部占位图服务）
+NO_IMAGE_SVG = "data:image/svg+xml;base64," + base64.b64encode(
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="150" height="150">'
+    b'<rect width="100%" height="100%" fill="#eeeeee"/>'
+    b'<text x="50%" y="50%" fill="#999999" font-size="16" text-anchor="middle" '
+    b'dominant-baseline="middle">No Image</text></svg>'
+).decode()
+
+# 孤立图片清理每个进程只执行一次
+_orphan_sweep_done = False
+
+def remove_files_async(paths):
+    """在后台线程中删除文件（失败忽略，遗留文件由启动清理处理）"""
+    def _remove():
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    threading.Thread(target=_remove, daemon=True).start()
+
+def cleanup_orphan_product_images(image_dir: str = PRODUCT_IMAGE_DIR) -> int:
+    """删除产品表中已不存在的产品ID对应的图片文件，返回删除的文件数"""
+    if not os.path.isdir(image_dir):
+        return 0
+
+    with get_db_connection() as conn:
+        product_ids = {row[0] for row in conn.execute("SELECT id FROM products")}
+
+    # 产品表为空（如迁移失败）时不做清理，避免误删全部图片
+    if not product_ids:
+        return 0
+
+    removed = 0
+    for filename in os.listdir(image_dir):
+        match = _PRODUCT_IMAGE_RE.match(filename)
+        if match and int(match.group(1)) not in product_ids:
+            try:
+                os.remove(os.path.join(image_dir, filename))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
 # 初始化函数
 def setup_database():
     """设置数据库（初始化并迁移数据）"""
@@ -474,6 +736,12 @@ def setup_database():
     # 从CSV迁移数据
     migrate_from_csv()
 
+    # 清理已删除产品遗留的图片（每个进程一次）
+    global _orphan_sweep_done
+    if not _orphan_sweep_done:
+        _orphan_sweep_done = True
+        cleanup_orphan_product_images()
+
     # 显示统计信息
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -0,0 +1,73 @@
+"""
+产品目录归档模块
+将产品表和图片字节打包为单个Feather文件，用于备份/迁移
+Product catalog archive export/import (Feather + zstd)
+"""
+import pandas as pd
+import os
+import sys
+
+# 添加database支持
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import get_db_connection, init_database
+
+# 产品图片目录与默认归档路径
+IMAGE_DIR = "assets/products"
+DEFAULT_ARCHIVE_PATH = "data/products_export.feather"
+
+def _read_image_bytes(image_dir, filename):
+    """读取图片文件字节（无图片或文件缺失时返回None）"""
+    if not isinstance(filename, str) or not filename:
+        return None
+    path = os.path.join(image_dir, filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+def export_products(archive_path=DEFAULT_ARCHIVE_PATH, image_dir=IMAGE_DIR):
+    """导出全部产品及其图片字节到一个Feather文件，返回导出的产品数"""
+    with get_db_connection() as conn:
+        df = pd.read_sql_query("SELECT * FROM products ORDER BY id", conn)
+
+    df['image_bytes'] = [_read_image_bytes(image_dir, name) for name in df['image']]
+    df.to_feather(archive_path, compression='zstd')
+    return len(df)
+
+def import_products(archive_path=DEFAULT_ARCHIVE_PATH, image_dir=IMAGE_DIR):
+    """从Feather归档恢复产品表和图片文件（按ID覆盖），返回导入的产品数"""
+    df = pd.read_feather(archive_path)
+
+    # 还原图片文件
+    os.makedirs(image_dir, exist_ok=True)
+    for filename, data in zip(df['image'], df.pop('image_bytes')):
+        if isinstance(filename, str) and filename and data is not None:
+            with open(os.path.join(image_dir, os.path.basename(filename)), 'wb') as f:
+                f.write(data)
+
+    # 单个事务内批量写回产品表
+    columns = list(df.columns)
+    rows = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+    # 用UPSERT而不是INSERT OR REPLACE：REPLACE删除冲突行时不触发DELETE触发器，
+    # 会让products_fts全文索引残留旧词条；ON CONFLICT走UPDATE，FTS更新触发器正常同步
+    updates = ','.join(f"{col}=excluded.{col}" for col in columns if col != 'id')
+    sql = (f"INSERT INTO products ({','.join(columns)}) "
+           f"VALUES ({','.join('?' for _ in columns)}) "
+           f"ON CONFLICT(id) DO UPDATE SET {updates}")
+
+    init_database()
+    with get_db_connection() as conn:
+        with conn:
+            conn.executemany(sql, rows)
+    return len(rows)
+
+if __name__ == "__main__":
+    # 用法: python utils/export.py [export|import] [路径]
+    action = sys.argv[1] if len(sys.argv) > 1 else "export"
+    path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_ARCHIVE_PATH
+
+    if action == "import":
+        print(f"Imported {import_products(path)} products from {path}")
+    else:
+        print(f"Exported {export_products(path)} products to {path}")
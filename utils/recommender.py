@@ -4,13 +4,14 @@
 Updated to use SQLite database instead of CSV
 """
 import pandas as pd
+import numpy as np
 import os
 import sys
 
 # 添加database支持
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from database import ProductDB, RecommendationDB
+from database import ProductDB, RecommendationDB, NO_IMAGE_SVG
 
 def load_products(csv_path=None):
     """
@@ -29,7 +30,78 @@ def load_products(csv_path=None):
         print(f"Error loading products from database: {e}")
         return pd.DataFrame()
 
-def recommend_products(scalp_type, concerns, products_df=None, top_n=3):
+# 特征列：适用头皮关键词 / 关注问题关键词
+SCALP_TYPE_KEYWORDS = ("油性", "干性", "正常", "敏感", "所有")
+CONCERN_KEYWORDS = ("油", "干", "头屑", "脱发", "敏感", "炎症", "毛囊")
+
+# 映射头皮类型到中文关键词
+SCALP_TYPE_MAPPING = {
+    "油性头皮 (Oily Scalp)": "油性",
+    "干性头皮 (Dry Scalp)": "干性",
+    "正常头皮 (Normal Scalp)": "正常",
+    "敏感头皮 (Sensitive Scalp)": "敏感"
+}
+
+def build_product_features(products_df):
+    """
+    预计算产品特征矩阵（产品列表不变时可重复使用）
+
+    参数:
+        products_df: 产品数据框
+
+    返回:
+        dict: type_matrix (N, 5) 布尔矩阵, concern_matrix (N, 7) float32矩阵, price_rank (N,) 数组
+    """
+    suitable = products_df['suitable_for'].astype(str)
+    product_concern = products_df['concern'].astype(str).str.lower()
+
+    type_matrix = np.column_stack([
+        suitable.str.contains(keyword, regex=False).to_numpy(dtype=bool)
+        for keyword in SCALP_TYPE_KEYWORDS
+    ]) if len(products_df) else np.zeros((0, len(SCALP_TYPE_KEYWORDS)), dtype=bool)
+
+    concern_matrix = np.column_stack([
+        product_concern.str.contains(keyword, regex=False).to_numpy(dtype=np.float32)
+        for keyword in CONCERN_KEYWORDS
+    ]) if len(products_df) else np.zeros((0, len(CONCERN_KEYWORDS)), dtype=np.float32)
+
+    # 价格适中优先（35是中间价位）
+    price_rank = np.abs(products_df['price_myr'].to_numpy(dtype=np.float32) - 35)
+
+    return {
+        'type_matrix': type_matrix,
+        'concern_matrix': concern_matrix,
+        'price_rank': price_rank
+    }
+
+def _build_concern_weights(concerns):
+    """根据头皮问题构建关注问题权重向量"""
+    weights = np.zeros(len(CONCERN_KEYWORDS), dtype=np.float32)
+    for concern in concerns:
+        if "油" in concern:
+            weights[0] += 5
+        if "干" in concern or "缺水" in concern:
+            weights[1] += 5
+        if "头屑" in concern:
+            weights[2] += 5
+        if "脱发" in concern or "掉发" in concern:
+            weights[3] += 5
+        if "敏感" in concern or "红肿" in concern:
+            weights[4] += 5
+        if "炎症" in concern:
+            weights[5] += 5
+        if "毛囊" in concern:
+            weights[6] += 5
+
+    # 特殊问题优先级
+    if weights[3] > 0:
+        weights[3] += 10  # 脱发问题优先
+    if weights[2] > 0:
+        weights[2] += 8   # 头屑问题次优先
+
+    return weights
+
+def recommend_products(scalp_type, concerns, products_df=None, top_n=3, features=None):
     """
     根据头皮类型和问题推荐产品
 
@@ -38,6 +110,7 @@ def recommend_products(scalp_type, concerns, products_df=None, top_n=3):
         concerns: 头皮问题列表
         products_df: 产品数据框（如果为None，自动从数据库加载）
         top_n: 推荐产品数量
+        features: build_product_features 预计算的特征（如果为None，现场计算）
 
     返回:
         推荐产品的DataFrame
@@ -49,85 +122,31 @@ def recommend_products(scalp_type, concerns, products_df=None, top_n=3):
     if products_df.empty:
         return pd.DataFrame()
 
-    # 映射头皮类型到中文关键词
-    type_mapping = {
-        "油性头皮 (Oily Scalp)": "油性",
-        "干性头皮 (Dry Scalp)": "干性",
-        "正常头皮 (Normal Scalp)": "正常",
-        "敏感头皮 (Sensitive Scalp)": "敏感"
-    }
+    if features is None:
+        features = build_product_features(products_df)
+
+    search_type = SCALP_TYPE_MAPPING.get(scalp_type, "所有")
+    type_matrix = features['type_matrix']
+    type_match = type_matrix[:, SCALP_TYPE_KEYWORDS.index(search_type)]
+    all_match = type_matrix[:, SCALP_TYPE_KEYWORDS.index("所有")]
 
-    search_type = type_mapping.get(scalp_type, "所有")
+    # 评分系统：头皮类型匹配（基础分）+ 关注问题匹配（一次矩阵乘法）
+    scores = np.where(type_match, 10, np.where(all_match, 5, 0)).astype(np.float32)
+    scores += features['concern_matrix'] @ _build_concern_weights(concerns)
 
     # 筛选适合的产品
     if search_type == "所有":
-        filtered_products = products_df.copy()
+        candidates = np.arange(len(products_df))
     else:
-        filtered_products = products_df[
-            (products_df['suitable_for'].str.contains(search_type, na=False)) |
-            (products_df['suitable_for'].str.contains('所有', na=False))
-        ]
+        candidates = np.flatnonzero(type_match | all_match)
+    if candidates.size == 0:
+        return products_df.iloc[0:0]
 
-    # 根据concerns进一步筛选
-    concern_keywords = []
-    for concern in concerns:
-        if "油" in concern:
-            concern_keywords.append("油")
-        if "干" in concern or "缺水" in concern:
-            concern_keywords.append("干")
-        if "头屑" in concern:
-            concern_keywords.append("头屑")
-        if "脱发" in concern or "掉发" in concern:
-            concern_keywords.append("脱发")
-        if "敏感" in concern or "红肿" in concern:
-            concern_keywords.append("敏感")
-        if "炎症" in concern:
-            concern_keywords.append("炎症")
-        if "毛囊" in concern:
-            concern_keywords.append("毛囊")
-
-    # 评分系统：根据匹配程度给产品打分
-    def score_product(product_row):
-        score = 0
-
-        # 头皮类型匹配（基础分）
-        if search_type in str(product_row['suitable_for']):
-            score += 10
-        elif '所有' in str(product_row['suitable_for']):
-            score += 5
-
-        # 关注问题匹配（每个匹配加分）
-        product_concern = str(product_row['concern']).lower()
-        for keyword in concern_keywords:
-            if keyword in product_concern:
-                score += 5
-
-        # 特殊问题优先级
-        if "脱发" in concern_keywords and "脱发" in product_concern:
-            score += 10  # 脱发问题优先
-        if "头屑" in concern_keywords and "头屑" in product_concern:
-            score += 8   # 头屑问题次优先
-
-        return score
-
-    # 给所有产品打分
-    filtered_products['recommendation_score'] = filtered_products.apply(score_product, axis=1)
-
-    # 按分数排序，分数相同时按价格排序（价格适中优先）
-    filtered_products['price_rank'] = abs(filtered_products['price_myr'] - 35)  # 35是中间价位
-    filtered_products = filtered_products.sort_values(
-        by=['recommendation_score', 'price_rank'],
-        ascending=[False, True]
-    )
+    # 按分数排序，分数相同时按价格排序（价格适中优先），再按原顺序
+    order = np.lexsort((candidates, features['price_rank'][candidates], -scores[candidates]))
 
     # 返回top_n个产品
-    recommended = filtered_products.head(top_n)
-
-    # 移除临时列
-    if 'recommendation_score' in recommended.columns:
-        recommended = recommended.drop(['recommendation_score', 'price_rank'], axis=1, errors='ignore')
-
-    return recommended
+    return products_df.iloc[candidates[order[:top_n]]]
 
 def save_recommendation_history(analysis_id, recommended_products):
     """
@@ -142,11 +161,10 @@ def save_recommendation_history(analysis_id, recommended_products):
 
     try:
         product_ids = recommended_products['id'].tolist()
-        reasons = []
-
-        for _, product in recommended_products.iterrows():
-            reason = f"推荐用于{product['suitable_for']}，针对{product['concern']}"
-            reasons.append(reason)
+        reasons = [
+            f"推荐用于{suitable_for}，针对{concern}"
+            for suitable_for, concern in zip(recommended_products['suitable_for'], recommended_products['concern'])
+        ]
 
         RecommendationDB.save_recommendations(analysis_id, product_ids, reasons)
     except Exception as e:
@@ -199,7 +217,7 @@ def format_product_card(product, show_image=False):
         if os.path.exists(img_path):
             image_html = f'<img src="assets/products/{product["image"]}" style="width: 100%; border-radius: 10px; margin-bottom: 15px;">'
         else:
-            image_html = '<img src="https://via.placeholder.com/300x200?text=Product+Image" style="width: 100%; border-radius: 10px; margin-bottom: 15px;">'
+            image_html = f'<img src="{NO_IMAGE_SVG}" style="width: 100%; border-radius: 10px; margin-bottom: 15px;">'
 
     # 添加库存状态显示（如果有）
     stock_html = ""